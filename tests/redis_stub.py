@@ -0,0 +1,92 @@
+""" Local stand-in for Redis server implementing commands used by tracker """
+
+import random
+import socketserver
+import threading
+
+
+class RedisStubHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            self.wfile.write(encode_reply(self.server.execute(args)))
+
+
+class RedisStub(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), RedisStubHandler)
+        self.data = {}
+        self.version = b'7.2.4'
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, args=(0.05,),
+                         daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def execute(self, args):
+        command = args[0].upper().decode()
+        with self.lock:
+            try:
+                return getattr(self, 'cmd_' + command.lower())(*args[1:])
+            except (AttributeError, TypeError, ValueError):
+                return Exception('ERR command ' + command)
+
+    def cmd_info(self, section):
+        return b'# Server\r\nredis_version:%b\r\n' % self.version
+
+    def cmd_hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def cmd_hset(self, key, field, value):
+        new = field not in self.data.setdefault(key, {})
+        self.data[key][field] = value
+        return int(new)
+
+    def cmd_hdel(self, key, *fields):
+        hash_ = self.data.get(key, {})
+        return sum(1 for f in fields if hash_.pop(f, None) is not None)
+
+    def cmd_hlen(self, key):
+        return len(self.data.get(key, {}))
+
+    def cmd_hgetall(self, key):
+        return [x for item in self.data.get(key, {}).items() for x in item]
+
+    def cmd_hrandfield(self, key, count, withvalues):
+        items = list(self.data.get(key, {}).items())
+        items = random.sample(items, min(int(count), len(items)))
+        return [x for item in items for x in item]
+
+    def cmd_del(self, *keys):
+        return sum(1 for k in keys if self.data.pop(k, None) is not None)
+
+    def cmd_expire(self, key, seconds):
+        return int(key in self.data)
+
+
+def encode_reply(reply):
+    if reply is None:
+        return b'$-1\r\n'
+    elif isinstance(reply, Exception):
+        return b'-%b\r\n' % str(reply).encode()
+    elif isinstance(reply, int):
+        return b':%d\r\n' % reply
+    elif isinstance(reply, bytes):
+        return b'$%d\r\n%b\r\n' % (len(reply), reply)
+    return b'*%d\r\n%b' % (len(reply), b''.join(encode_reply(x)
+                                                 for x in reply))
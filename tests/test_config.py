@@ -0,0 +1,46 @@
+import json
+import os
+import tempfile
+import unittest
+
+from warp.config import load_config, make_config, ConfigError, cfg
+
+
+class TestConfig(unittest.TestCase):
+    def test_defaults(self):
+        self.assertEqual(load_config([], environ={}), cfg)
+
+    def test_precedence(self):
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as file:
+            json.dump({'port': 1000, 'workers': 2, 'backlog': 10}, file)
+        try:
+            environ = {'WARP_CONFIG': path, 'WARP_WORKERS': '3',
+                       'WARP_PORT': '2000'}
+            config = load_config(['--port', '3000'], environ=environ)
+        finally:
+            os.remove(path)
+        self.assertEqual(config.port, 3000)
+        self.assertEqual(config.workers, 3)
+        self.assertEqual(config.backlog, 10)
+
+    def test_immutable(self):
+        with self.assertRaises(AttributeError):
+            cfg.port = 1
+
+    def test_types(self):
+        config = make_config({
+            'open_tracker': 'yes',
+            'passkeys_file': '',
+            'info_hash_blacklist': 'a' * 40 + ', ' + 'b' * 40,
+        })
+        self.assertIs(config.open_tracker, True)
+        self.assertIsNone(config.passkeys_file)
+        self.assertEqual(config.info_hash_blacklist, ('a' * 40, 'b' * 40))
+
+    def test_invalid(self):
+        for values in ({'port': 'x'}, {'port': 70000}, {'workers': 0},
+                       {'numwant': 500}, {'peer_store': 'mysql'},
+                       {'info_hash_whitelist': 'abc'}, {'unknown': 1}):
+            with self.assertRaises(ConfigError):
+                make_config(values)
@@ -1,8 +1,16 @@
+import os
+import time
+import tempfile
 import unittest
 
+from warp import bencode
 from warp.core import WarpCore, Torrent, ip4_to_4bytes, port_to_2bytes
-from warp.core import Peer
+from warp.core import Peer, transfer_delta, InfoHashNotFound
+from warp.core import UNAVAILABLE_RESPONSE
+from warp.redis_client import RedisError
 from warp.config import cfg
+from warp.passkeys import PasskeyStore
+from warp.stats import StatsWriter
 
 
 class TestWarpCore(unittest.TestCase):
@@ -22,11 +30,161 @@ class TestWarpCore(unittest.TestCase):
         torrent = self.warp_core.get_torrent_by_hash(info_hash)
         self.assertEqual(torrent, self.torrent)
 
+    def test_interval_jitter(self):
+        intervals = {self.warp_core.get_interval() for _ in range(100)}
+        self.assertGreater(len(intervals), 1)
+        self.assertGreaterEqual(min(intervals),
+                                cfg.check_interval - cfg.interval_jitter)
+        self.assertLessEqual(max(intervals),
+                             cfg.check_interval + cfg.interval_jitter)
+
+
+class TestAnnounce(unittest.TestCase):
+    info_hash = b'a' * 20
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as file:
+            file.write(b'key alice\n')
+        self.warp_core = WarpCore(cfg)
+        self.warp_core.passkeys = PasskeyStore(self.path)
+        self.warp_core.passkeys.load()
+        self.warp_core.stats = StatsWriter(':memory:', 60)
+        self.warp_core.whitelist = {self.info_hash}
+
+    def tearDown(self):
+        self.warp_core.passkeys = None
+        self.warp_core.stats = None
+        self.warp_core.whitelist = set()
+        self.warp_core.peer_store.drop(self.info_hash)
+        os.remove(self.path)
+
+    def _announce(self, **params):
+        announce = {
+            'passkey': b'key',
+            'info_hash': self.info_hash,
+            'peer_id': b'peer_id',
+            'host': b'127.0.0.1',
+            'port': b'6881',
+            'left': b'0',
+            'compact': b'1',
+        }
+        announce.update(params)
+        return bencode.decode(self.warp_core.announce(announce))
+
+    def test_stopped_transfer(self):
+        self._announce(uploaded=b'100')
+        self._announce(uploaded=b'1000')
+        response = self._announce(uploaded=b'1000', event=b'stopped')
+        self.assertEqual(response[b'complete'], 0)
+        self.assertEqual(self.warp_core.stats._users, {b'alice': [1000, 0]})
+        self.assertEqual(self.warp_core.stats._torrents,
+                         {self.info_hash: [0, 1000, 0]})
+
+    def test_numwant(self):
+        self._announce()
+        self._announce(port=b'6882')
+        self.assertEqual(len(self._announce(numwant=b'1')[b'peers']), 6)
+        self.assertEqual(self._announce(numwant=b'-1')[b'peers'], b'')
+        self.assertEqual(len(self._announce(numwant=b'abc')[b'peers']), 12)
+        self.assertEqual(self.warp_core.get_numwant(b'100000'),
+                         cfg.numwant_max)
+        self.assertEqual(self.warp_core.get_numwant(b''), cfg.numwant)
+
+    def test_peer_store_error(self):
+        def fail(*args):
+            raise RedisError('Connection closed')
+
+        self.warp_core.peer_store.announce = fail
+        try:
+            response = self.warp_core.announce({
+                'passkey': b'key',
+                'info_hash': self.info_hash,
+                'peer_id': b'peer_id',
+                'host': b'127.0.0.1',
+                'port': b'6881',
+                'left': b'0',
+                'compact': b'1',
+            })
+        finally:
+            del self.warp_core.peer_store.announce
+        self.assertEqual(response, UNAVAILABLE_RESPONSE)
+
+    def test_background_expiry(self):
+        self.warp_core.cfg = cfg._replace(expire_interval=0.01, peer_ttl=1)
+        self._announce()
+        self.warp_core.start_expiry()
+        try:
+            self.assertEqual(self._announce()[b'complete'], 1)
+            time.sleep(1.2)
+            self.assertEqual(
+                self.warp_core.peer_store.counts(self.info_hash), (0, 0))
+        finally:
+            self.warp_core.stop_expiry()
+            self.warp_core.cfg = cfg
+
+
+class TestInfoHashFilter(unittest.TestCase):
+    def setUp(self):
+        self.warp_core = WarpCore(cfg)
+        self.warp_core.cfg = cfg._replace(open_tracker_max_torrents=2)
+        self.warp_core.swarms.clear()
+
+    def tearDown(self):
+        self.warp_core.cfg = cfg
+        self.warp_core.whitelist = set()
+        self.warp_core.blacklist = set()
+        self.warp_core.swarms.clear()
+        self.warp_core.whitelisted_swarms.clear()
+
+    def test_unknown_rejected(self):
+        self.assertFalse(self.warp_core.is_info_hash_allowed(b'unknown'))
+        with self.assertRaises(InfoHashNotFound):
+            self.warp_core.get_torrent_by_hash(b'unknown')
+
+    def test_whitelist(self):
+        self.warp_core.whitelist = {b'white'}
+        self.assertTrue(self.warp_core.is_info_hash_allowed(b'white'))
+        swarm = self.warp_core.get_torrent_by_hash(b'white')
+        self.assertIs(self.warp_core.get_torrent_by_hash(b'white'), swarm)
+
+    def test_blacklist(self):
+        self.warp_core.cfg = self.warp_core.cfg._replace(open_tracker=True)
+        self.warp_core.blacklist = {b'black'}
+        self.assertFalse(self.warp_core.is_info_hash_allowed(b'black'))
+        self.assertTrue(self.warp_core.is_info_hash_allowed(b'other'))
+
+    def test_open_tracker_lru(self):
+        self.warp_core.cfg = self.warp_core.cfg._replace(open_tracker=True)
+        for info_hash in (b'a', b'b', b'a', b'c'):
+            self.warp_core.get_torrent_by_hash(info_hash)
+        self.assertEqual(list(self.warp_core.swarms), [b'a', b'c'])
+
+    def test_whitelisted_never_evicted(self):
+        self.warp_core.cfg = self.warp_core.cfg._replace(open_tracker=True)
+        self.warp_core.whitelist = {b'white'}
+        peer = Peer({'peer_id': b'peer_id', 'host': b'127.0.0.1',
+                     'port': b'6881', 'left': b'0', 'compact': b'1'})
+        self.warp_core.get_torrent_by_hash(b'white')
+        self.warp_core.peer_store.upsert(b'white', peer)
+        for info_hash in (b'a', b'b', b'c'):
+            self.warp_core.get_torrent_by_hash(info_hash)
+        self.assertEqual(list(self.warp_core.swarms), [b'b', b'c'])
+        self.assertIn(b'white', self.warp_core.whitelisted_swarms)
+        self.assertEqual(self.warp_core.peer_store.counts(b'white'), (1, 0))
+        self.warp_core.peer_store.drop(b'white')
+
+    def test_whitelist_over_cap(self):
+        self.warp_core.whitelist = {b'w1', b'w2', b'w3'}
+        for info_hash in (b'w1', b'w2', b'w3'):
+            self.warp_core.get_torrent_by_hash(info_hash)
+        self.assertEqual(len(self.warp_core.whitelisted_swarms), 3)
+        self.assertEqual(list(self.warp_core.swarms), [])
+
 
 class TestTorrent(unittest.TestCase):
     def setUp(self):
         self.torrent = Torrent(self._mock_metafile())
-        self.peer = object()
 
     def _mock_metafile(self):
         class MockTorrentMetaFile(object):
@@ -41,20 +199,6 @@ class TestTorrent(unittest.TestCase):
 
         return MockTorrentMetaFile('path')
 
-    def test_add_get_peer(self):
-        self.torrent.add_peer(self.peer)
-        peers = list(self.torrent.get_peers())
-
-        self.assertEqual(len(peers), 1)
-        self.assertEqual(peers[0], self.peer)
-
-    def test_add_uniq_peers_only(self):
-        self.torrent.add_peer(self.peer)
-        self.torrent.add_peer(self.peer)
-        peers = self.torrent.get_peers()
-
-        self.assertEqual(len(peers), 1)
-
     def test_create_info_hash(self):
         bencoded_info = b'info'
         info_hash = b'Y\xbd\n?\xf4;2\x84\x9b1\x9ed]G\x98\xd8\xa5\xd1\xe8\x89'
@@ -103,6 +247,26 @@ class TestPeer(unittest.TestCase):
 
 
 class TestFuncts(unittest.TestCase):
+    def _peer(self, uploaded, downloaded):
+        return Peer({
+            'peer_id': b'peer_id',
+            'host': b'127.0.0.1',
+            'port': b'666',
+            'left': b'0',
+            'compact': b'1',
+            'uploaded': uploaded,
+            'downloaded': downloaded,
+        })
+
+    def test_transfer_delta(self):
+        previous = self._peer(b'100', b'50')
+        self.assertEqual(transfer_delta(self._peer(b'150', b'60'), previous),
+                         (50, 10))
+        self.assertEqual(transfer_delta(previous, None), (100, 50))
+        # Restarted client reports counters from zero
+        self.assertEqual(transfer_delta(self._peer(b'5', b'0'), previous),
+                         (5, 0))
+
     def test_ip4_to_4byte(self):
         self.assertEqual(ip4_to_4bytes(b'46.163.130.47'), b'.\xa3\x82/')
 
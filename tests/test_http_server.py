@@ -0,0 +1,270 @@
+import gzip
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from urllib.parse import urlparse, quote_from_bytes
+
+from warp import bencode
+from warp.http_server import query_value, parse_range, accepts_gzip
+from warp.http_server import etag_matches, entity_response, metafile_entity
+from warp.http_server import RangeNotSatisfiable, TrackerHTTPServer
+from warp.http_server import AnnounceRequest, TorrentRequest, path_passkey
+from warp.http_server import AdminRequest
+from warp.config import cfg, make_config
+from warp.core import WarpCore, INVALID_PASSKEY_RESPONSE
+from warp.passkeys import PasskeyStore
+
+
+class MockTorrent(object):
+    def get_meta_file_content(self, announce_url=None):
+        return b'd8:announce' + (announce_url or b'3:url') + b'e'
+
+
+class TestEntityResponse(unittest.TestCase):
+    def setUp(self):
+        self.entity = metafile_entity(MockTorrent())
+
+    def _response(self, headers):
+        return entity_response('application/x-bittorrent', self.entity,
+                               headers, 'public')
+
+    def test_full(self):
+        response = self._response({})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.body, b'd8:announce3:urle')
+        self.assertIn(('ETag', self.entity.etag), response.headers)
+
+    def test_gzip(self):
+        response = self._response({'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(gzip.decompress(response.body), self.entity.content)
+        self.assertIn(('Content-Encoding', 'gzip'), response.headers)
+        self.assertIn(('ETag', self.entity.gzip_etag), response.headers)
+
+    def test_not_modified(self):
+        response = self._response({'If-None-Match': self.entity.etag})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.body, b'')
+
+    def test_range(self):
+        response = self._response({'Range': 'bytes=1-7'})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.body, b'8:annou')
+        self.assertIn(('Content-Range', 'bytes 1-7/17'), response.headers)
+
+    def test_range_not_satisfiable(self):
+        response = self._response({'Range': 'bytes=100-'})
+        self.assertEqual(response.status, 416)
+
+    def test_cached(self):
+        torrent = MockTorrent()
+        self.assertIs(metafile_entity(torrent), metafile_entity(torrent))
+
+    def test_personal_not_cached(self):
+        torrent = MockTorrent()
+        entity = metafile_entity(torrent, b'4:user')
+        self.assertIsNot(metafile_entity(torrent, b'4:user'), entity)
+        self.assertIsNone(entity.gzipped)
+        response = entity_response('application/x-bittorrent', entity,
+                                   {'Accept-Encoding': 'gzip'}, 'private')
+        self.assertEqual(response.body, b'd8:announce4:usere')
+        self.assertIn(('ETag', entity.etag), response.headers)
+
+
+class MockServer(object):
+    def __init__(self, core):
+        self.core = core
+        self.announce_path = '/announce'
+
+
+class TestPrivateRequests(unittest.TestCase):
+    passkey = b'0123456789abcdef0123456789abcdef'
+    info_hash = b'i' * 20
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as file:
+            file.write(self.passkey + b' alice\n')
+        self.core = WarpCore(cfg)
+        self.core.passkeys = PasskeyStore(self.path)
+        self.core.passkeys.load()
+        self.core.whitelist = {self.info_hash}
+        self.server = MockServer(self.core)
+
+    def tearDown(self):
+        self.core.passkeys = None
+        self.core.whitelist = set()
+        self.core.peer_store.drop(self.info_hash)
+        os.remove(self.path)
+
+    def _announce(self, passkey):
+        query = 'info_hash={}&peer_id=peer_id&port=6881&left=0&compact=1'
+        url = '/announce/{}?{}'.format(
+            quote_from_bytes(passkey), query.format(
+                quote_from_bytes(self.info_hash)))
+        request = AnnounceRequest(self.server, urlparse(url), '127.0.0.1')
+        content_type, body = request.process()
+        return body
+
+    def test_announce_with_passkey(self):
+        response = bencode.decode(self._announce(self.passkey))
+        self.assertEqual(response[b'complete'], 1)
+        self.assertEqual(response[b'peers'], b'\x7f\x00\x00\x01\x1a\xe1')
+
+    def test_announce_invalid_passkey(self):
+        self.assertEqual(self._announce(self.passkey[:20]),
+                         INVALID_PASSKEY_RESPONSE)
+        self.assertEqual(self._announce(self.passkey * 3),
+                         INVALID_PASSKEY_RESPONSE)
+
+    def test_torrent_invalid_passkey(self):
+        self.core.get_torrent_by_file_name = lambda name: object()
+        request = TorrentRequest(
+            self.server, urlparse('/files/name?passkey=wrong'), '127.0.0.1')
+        response = request.process()
+        del self.core.get_torrent_by_file_name
+        self.assertEqual(response.status, 403)
+
+
+class TestAdminRequest(unittest.TestCase):
+    def setUp(self):
+        core = WarpCore(cfg)
+        self.server = MockServer(core)
+        core.cfg = cfg._replace(admin_token='secret')
+
+    def tearDown(self):
+        self.server.core.cfg = cfg
+
+    def _process(self, url, headers=None):
+        request = AdminRequest(self.server, urlparse(url), '127.0.0.1',
+                               headers)
+        return request.process()
+
+    def test_header_token(self):
+        content_type, body = self._process(
+            '/admin/profile', {'X-Admin-Token': 'secret'})
+        self.assertIn('stage', body)
+
+    def test_query_token_rejected(self):
+        response = self._process('/admin/profile?token=secret')
+        self.assertEqual(response.status, 403)
+
+
+class ServerTestCase(unittest.TestCase):
+    max_connections = 1
+
+    def setUp(self):
+        cfg = make_config({
+            'port': 0,
+            'workers': 2,
+            'header_timeout': 0.3,
+            'max_request_size': 1024,
+            'max_connections': self.max_connections,
+        })
+        self.server = TrackerHTTPServer(cfg, core=None)
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  args=(0.05,), daemon=True)
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _connect(self):
+        return socket.create_connection(self.server.server_address, 2)
+
+    def _get_unknown(self, sock, count=1):
+        sock.sendall(b'GET /unknown HTTP/1.1\r\n\r\n' * count)
+        data = b''
+        while data.count(b'Unknown request') < count:
+            chunk = sock.recv(1024)
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+
+class TestSlowClientProtection(ServerTestCase):
+    def test_slow_headers(self):
+        with self._connect() as sock:
+            started = time.monotonic()
+            with self.assertRaises(OSError):
+                for char in b'GET /unknown HTTP/1.1\r\n' * 10:
+                    sock.send(bytes([char]))
+                    time.sleep(0.05)
+            self.assertLess(time.monotonic() - started, 2)
+
+    def test_request_too_large(self):
+        with self._connect() as sock:
+            sock.sendall(b'GET /unknown HTTP/1.1\r\nX: ' + b'x' * 2000)
+            self.assertIn(b' 431 ', sock.recv(1024))
+
+    def test_connections_cap(self):
+        with self._connect() as first:
+            self.assertIn(b' 200 ', self._get_unknown(first))
+            with self._connect() as second:
+                self.assertIn(b' 503 ', second.recv(1024))
+
+
+class TestSlowClientsDoNotHoldWorkers(ServerTestCase):
+    max_connections = 16
+
+    def test_fast_client_served(self):
+        slow = [self._connect() for _ in range(self.server.cfg.workers)]
+        for sock in slow:
+            sock.send(b'G')
+        idle = self._connect()
+        self.assertIn(b' 200 ', self._get_unknown(idle))
+
+        with self._connect() as fast:
+            started = time.monotonic()
+            self.assertIn(b' 200 ', self._get_unknown(fast))
+            self.assertLess(time.monotonic() - started, 0.2)
+
+        # Idle connection is still kept alive
+        self.assertIn(b' 200 ', self._get_unknown(idle))
+        for sock in slow + [idle]:
+            sock.close()
+
+    def test_pipelined_requests(self):
+        with self._connect() as sock:
+            self.assertEqual(self._get_unknown(sock, 2).count(b' 200 '), 2)
+
+
+class TestFuncts(unittest.TestCase):
+    def test_query_value(self):
+        query = 'peer_id=abc&info_hash=%12%34+x&port=1'
+        self.assertEqual(query_value(query, 'info_hash'), b'\x12\x34 x')
+        self.assertEqual(query_value(query, 'port'), b'1')
+        self.assertIsNone(query_value(query, 'hash'))
+
+    def test_path_passkey(self):
+        passkey = b'a' * 32
+        self.assertEqual(path_passkey('/announce/' + 'a' * 32, '/announce'),
+                         passkey)
+        self.assertIsNone(path_passkey('/announce/', '/announce'))
+        self.assertIsNone(path_passkey('/announce/' + 'a' * 65, '/announce'))
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range('bytes=90-200', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=50-', 100), (50, 99))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 100))
+        self.assertIsNone(parse_range('items=0-1', 100))
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range('bytes=100-', 100)
+
+    def test_accepts_gzip(self):
+        self.assertTrue(accepts_gzip('gzip'))
+        self.assertTrue(accepts_gzip('deflate, gzip;q=0.5'))
+        self.assertFalse(accepts_gzip('gzip;q=0'))
+        self.assertFalse(accepts_gzip('identity'))
+
+    def test_etag_matches(self):
+        self.assertTrue(etag_matches('"a", W/"b"', '"b"'))
+        self.assertTrue(etag_matches('*', '"b"'))
+        self.assertFalse(etag_matches(None, '"b"'))
+        self.assertFalse(etag_matches('"a"', '"b"'))
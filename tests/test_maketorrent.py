@@ -0,0 +1,104 @@
+import os
+import stat
+import hashlib
+import tempfile
+import unittest
+
+from warp.core import TorrentMetaFile
+from warp.maketorrent import create_torrent, write_torrent, hash_pieces
+from warp.maketorrent import auto_piece_length, MIN_PIECE_LENGTH
+from warp.maketorrent import hashing_processes, parse_args, EmptyContent
+
+
+class TestMakeTorrent(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.content_dir = os.path.join(self.tmp_dir.name, 'content')
+        os.makedirs(os.path.join(self.content_dir, 'sub'))
+        self.data = []
+        for name, size in (('a', 1000), ('sub/b', 0), ('sub/c', 5000)):
+            data = bytes(x % 251 for x in range(size))
+            with open(os.path.join(self.content_dir, name), 'wb') as file:
+                file.write(data)
+            self.data.append(data)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _expected_pieces(self, piece_length):
+        data = b''.join(self.data)
+        return b''.join(hashlib.sha1(data[i:i + piece_length]).digest()
+                        for i in range(0, len(data), piece_length))
+
+    def test_hash_pieces(self):
+        files = [(os.path.join(self.content_dir, name), len(data))
+                 for name, data in zip(('a', 'sub/b', 'sub/c'), self.data)]
+        expected = self._expected_pieces(64)
+        self.assertEqual(hash_pieces(files, 64, workers=1), expected)
+        self.assertEqual(hash_pieces(files, 64, workers=2), expected)
+
+    def test_create_directory_torrent(self):
+        meta_data = create_torrent(self.content_dir, b'url', 1024, workers=1)
+        info = meta_data[b'info']
+        self.assertEqual(info[b'name'], b'content')
+        self.assertEqual(info[b'pieces'], self._expected_pieces(1024))
+        self.assertEqual(info[b'files'], [
+            {b'length': 1000, b'path': [b'a']},
+            {b'length': 0, b'path': [b'sub', b'b']},
+            {b'length': 5000, b'path': [b'sub', b'c']},
+        ])
+
+    def test_create_file_torrent(self):
+        path = os.path.join(self.content_dir, 'a')
+        meta_data = create_torrent(path, b'url', workers=1)
+        self.assertEqual(meta_data[b'info'][b'length'], 1000)
+        self.assertEqual(meta_data[b'info'][b'piece length'],
+                         MIN_PIECE_LENGTH)
+
+    def test_write_torrent(self):
+        meta_data = create_torrent(self.content_dir, b'url', workers=1)
+        path = write_torrent(meta_data, self.tmp_dir.name)
+        self.assertEqual(os.path.basename(path), 'content.torrent')
+        self.assertEqual(TorrentMetaFile(path).meta_data, meta_data)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)),
+                         ['content', 'content.torrent'])
+
+    def test_empty_content(self):
+        empty_dir = os.path.join(self.tmp_dir.name, 'empty')
+        os.makedirs(empty_dir)
+        with self.assertRaises(EmptyContent):
+            create_torrent(empty_dir, b'url', workers=1)
+        with self.assertRaises(EmptyContent):
+            create_torrent(os.path.join(self.content_dir, 'sub', 'b'),
+                           b'url', workers=1)
+
+    def test_write_torrent_mode(self):
+        meta_data = create_torrent(self.content_dir, b'url', workers=1)
+        umask = os.umask(0o022)
+        try:
+            path = write_torrent(meta_data, self.tmp_dir.name)
+            self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o644)
+            os.chmod(path, 0o640)
+            write_torrent(meta_data, self.tmp_dir.name)
+            self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o640)
+        finally:
+            os.umask(umask)
+
+    def test_defaults_from_config(self):
+        environ = {'WARP_TORRENTS_DIR': self.tmp_dir.name,
+                   'WARP_ANNOUNCE_URL': 'http://tracker/announce'}
+        args = parse_args(['path'], environ)
+        self.assertEqual(args.torrents_dir, self.tmp_dir.name)
+        self.assertEqual(args.announce_url, 'http://tracker/announce')
+        args = parse_args(['path', '-o', 'out'], environ)
+        self.assertEqual(args.torrents_dir, 'out')
+
+    def test_hashing_processes(self):
+        self.assertEqual(hashing_processes(1, 8), 1)
+        self.assertEqual(hashing_processes(3, 8), 3)
+        self.assertEqual(hashing_processes(100, 8), 8)
+        self.assertEqual(hashing_processes(0, 8), 1)
+
+    def test_auto_piece_length(self):
+        self.assertEqual(auto_piece_length(0), MIN_PIECE_LENGTH)
+        self.assertEqual(auto_piece_length(2 ** 30), 2 ** 20)
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+
+from warp.passkeys import PasskeyStore, read_passkeys
+
+
+class TestPasskeyStore(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as file:
+            file.write(b'# comment\n\nkey1 alice\nkey2\n')
+        self.store = PasskeyStore(self.path)
+        self.store.load()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_read_passkeys(self):
+        users = read_passkeys(self.path)
+        self.assertEqual(users, {b'key1': b'alice', b'key2': b'key2'})
+
+    def test_skip_long_passkey(self):
+        with open(self.path, 'wb') as file:
+            file.write(b'a' * 32 + b' alice\n' + b'b' * 65 + b' bob\n')
+        self.assertEqual(read_passkeys(self.path), {b'a' * 32: b'alice'})
+
+    def test_is_valid(self):
+        self.assertTrue(self.store.is_valid(b'key1'))
+        self.assertFalse(self.store.is_valid(b'key3'))
+        self.assertFalse(self.store.is_valid(None))
+
+    def test_reload(self):
+        with open(self.path, 'wb') as file:
+            file.write(b'key3 bob\n')
+        self.store.load()
+        self.assertFalse(self.store.is_valid(b'key1'))
+        self.assertEqual(self.store.get_user(b'key3'), b'bob')
+
+    def test_keep_table_on_error(self):
+        os.remove(self.path)
+        self.store.load()
+        self.assertTrue(self.store.is_valid(b'key1'))
+        open(self.path, 'wb').close()
@@ -0,0 +1,130 @@
+import time
+import unittest
+
+from warp.core import Peer
+from warp.config import ConfigError
+from warp.peer_store import MemoryPeerStore, RedisPeerStore
+from warp.peer_store import check_redis_version
+from warp.redis_client import RedisError
+from tests.redis_stub import RedisStub
+
+
+def make_peer(port, left=b'0', uploaded=b'0'):
+    return Peer({
+        'peer_id': b'peer_id',
+        'host': b'127.0.0.1',
+        'port': port,
+        'left': left,
+        'compact': b'1',
+        'uploaded': uploaded,
+    })
+
+
+class PeerStoreTests(object):
+    """ Tests common for all peer store backends """
+    info_hash = b'h' * 20
+
+    def test_upsert_returns_previous(self):
+        self.assertIsNone(self.store.upsert(self.info_hash, make_peer(b'1')))
+        previous = self.store.upsert(
+            self.info_hash, make_peer(b'1', uploaded=b'10'))
+        self.assertEqual(previous, make_peer(b'1'))
+        self.assertEqual(previous.uploaded, 0)
+
+    def test_add_uniq_peers_only(self):
+        self.store.upsert(self.info_hash, make_peer(b'1'))
+        self.store.upsert(self.info_hash, make_peer(b'1'))
+        self.assertEqual(len(self.store.sample(self.info_hash, 10)), 1)
+
+    def test_sample(self):
+        for port in range(1, 11):
+            self.store.upsert(self.info_hash, make_peer(b'%d' % port))
+        self.assertEqual(len(self.store.sample(self.info_hash, 5)), 5)
+        self.assertEqual(len(self.store.sample(self.info_hash, 50)), 10)
+        self.assertEqual(self.store.sample(b'other', 5), [])
+
+    def test_counts(self):
+        self.store.upsert(self.info_hash, make_peer(b'1'))
+        self.store.upsert(self.info_hash, make_peer(b'2', left=b'5'))
+        self.assertEqual(self.store.counts(self.info_hash), (1, 1))
+        # Leecher became seeder
+        self.store.upsert(self.info_hash, make_peer(b'2'))
+        self.assertEqual(self.store.counts(self.info_hash), (2, 0))
+
+    def test_remove_and_drop(self):
+        self.store.upsert(self.info_hash, make_peer(b'1', uploaded=b'10'))
+        self.store.upsert(self.info_hash, make_peer(b'2'))
+        removed = self.store.remove(self.info_hash, make_peer(b'1'))
+        self.assertEqual(removed.uploaded, 10)
+        self.assertIsNone(self.store.remove(self.info_hash, make_peer(b'1')))
+        self.assertEqual(self.store.counts(self.info_hash), (1, 0))
+        self.store.drop(self.info_hash)
+        self.assertEqual(self.store.counts(self.info_hash), (0, 0))
+
+    def test_expire(self):
+        old_peer = make_peer(b'1')
+        old_peer.last_seen = time.time() - 100
+        self.store.upsert(self.info_hash, old_peer)
+        self.store.upsert(self.info_hash, make_peer(b'2'))
+        self.assertEqual(self.store.expire(self.info_hash, 50), 1)
+        self.assertEqual(self.store.sample(self.info_hash, 10),
+                         [make_peer(b'2')])
+        self.assertEqual(self.store.counts(self.info_hash), (1, 0))
+
+
+    def test_announce(self):
+        self.store.upsert(self.info_hash, make_peer(b'1', left=b'5'))
+        previous, peers, counts = self.store.announce(
+            self.info_hash, make_peer(b'2'), False, 10)
+        self.assertIsNone(previous)
+        self.assertEqual(sorted(peers, key=lambda p: p.port),
+                         [make_peer(b'1'), make_peer(b'2')])
+        self.assertEqual(counts, (1, 1))
+
+        previous, peers, counts = self.store.announce(
+            self.info_hash, make_peer(b'2', uploaded=b'10'), True, 0)
+        self.assertEqual(previous, make_peer(b'2'))
+        self.assertEqual(peers, [])
+        self.assertEqual(counts, (0, 1))
+
+
+class TestMemoryPeerStore(PeerStoreTests, unittest.TestCase):
+    def setUp(self):
+        self.store = MemoryPeerStore()
+
+
+class TestRedisPeerStore(PeerStoreTests, unittest.TestCase):
+    def setUp(self):
+        self.server = RedisStub()
+        self.store = RedisPeerStore('127.0.0.1', self.server.port,
+                                    swarm_ttl=60)
+
+    def tearDown(self):
+        self.store.pool.close()
+        self.server.stop()
+
+    def test_pooled_connection_reused(self):
+        self.store.counts(self.info_hash)
+        self.store.counts(self.info_hash)
+        self.assertEqual(len(self.store.pool._idle), 1)
+
+    def test_announce_one_round_trip(self):
+        pipelines = []
+        pipeline = self.store.pool.pipeline
+        self.store.pool.pipeline = lambda commands: (
+            pipelines.append(commands) or pipeline(commands))
+        self.store.announce(self.info_hash, make_peer(b'1'), False, 10)
+        self.assertEqual(len(pipelines), 1)
+
+    def test_server_version(self):
+        self.assertEqual(self.store.server_version(), (7, 2))
+        check_redis_version(self.store)
+        self.server.version = b'6.0.16'
+        with self.assertRaises(ConfigError):
+            check_redis_version(self.store)
+
+    def test_connection_error(self):
+        self.server.stop()
+        self.store.pool.close()
+        with self.assertRaises(RedisError):
+            self.store.counts(self.info_hash)
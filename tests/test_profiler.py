@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from warp.profiler import Profiler, NULL_CONTEXT, collapse_stack
+
+
+def busy_announce(duration):
+    finish = time.monotonic() + duration
+    while time.monotonic() < finish:
+        pass
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.profiler = Profiler()
+
+    def tearDown(self):
+        self.profiler.stop()
+
+    def test_disabled(self):
+        self.assertIs(self.profiler.stage('stage'), NULL_CONTEXT)
+        self.assertIs(self.profiler.sampled(), NULL_CONTEXT)
+        with self.profiler.stage('stage'):
+            pass
+        self.assertEqual(self.profiler.stages, {})
+
+    def test_stages(self):
+        self.profiler.start(interval=0.001)
+        for _ in range(3):
+            with self.profiler.stage('stage'):
+                pass
+        count, total, longest = self.profiler.stages['stage']
+        self.assertEqual(count, 3)
+        self.assertGreaterEqual(total, longest)
+        self.assertIn('stage', self.profiler.stages_report())
+
+    def test_sampling(self):
+        self.profiler.start(interval=0.001)
+        with self.profiler.sampled():
+            busy_announce(0.1)
+        busy_announce(0.05)
+        self.profiler.stop()
+
+        lines = self.profiler.collapsed().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertIn('test_profiler.py:busy_announce', stack)
+            self.assertGreater(int(count), 0)
+
+    def test_toggle_and_dump(self):
+        self.assertTrue(self.profiler.toggle())
+        self.assertFalse(self.profiler.toggle())
+        with tempfile.TemporaryDirectory() as dir_path:
+            path = self.profiler.dump(dir_path)
+            self.assertEqual(os.path.dirname(path), dir_path)
+            self.assertTrue(os.path.exists(path))
+
+    def test_concurrent_start(self):
+        switch_interval = sys.getswitchinterval()
+        threads = [threading.Thread(target=self.profiler.start)
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.profiler.stop()
+        self.assertEqual(sys.getswitchinterval(), switch_interval)
+        self.assertEqual([x for x in threading.enumerate()
+                          if x.name == 'Profiler'], [])
+
+    def test_collapse_stack(self):
+        def inner():
+            import sys
+            return collapse_stack(sys._getframe())
+
+        self.assertTrue(inner().endswith(
+            'test_profiler.py:test_collapse_stack;test_profiler.py:inner'))
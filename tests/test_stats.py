@@ -0,0 +1,47 @@
+import unittest
+
+from warp.stats import StatsWriter
+
+
+class TestStatsWriter(unittest.TestCase):
+    def setUp(self):
+        self.writer = StatsWriter(':memory:', 1)
+        self.conn = self.writer.connect()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _torrent_stats(self):
+        return self.conn.execute('SELECT * FROM torrent_stats').fetchall()
+
+    def test_flush_accumulates(self):
+        self.writer.add_torrent(b'hash', 1, 10, 20)
+        self.writer.add_torrent(b'hash', 0, 5, 0)
+        self.writer.add_user(b'alice', 15, 20)
+        self.writer.flush(self.conn)
+        self.assertEqual(self._torrent_stats(), [(b'hash', 1, 15, 20)])
+
+        self.writer.add_torrent(b'hash', 1, 1, 1)
+        self.writer.flush(self.conn)
+        self.assertEqual(self._torrent_stats(), [(b'hash', 2, 16, 21)])
+        users = self.conn.execute('SELECT * FROM user_stats').fetchall()
+        self.assertEqual(users, [(b'alice', 15, 20)])
+
+    def test_failed_flush_keeps_deltas(self):
+        self.writer.add_torrent(b'hash', 1, 10, 20)
+        self.conn.execute('DROP TABLE torrent_stats')
+        self.writer.flush(self.conn)
+
+        self.conn.executescript(
+            'CREATE TABLE torrent_stats (info_hash BLOB PRIMARY KEY, '
+            'completed INTEGER, uploaded INTEGER, downloaded INTEGER)')
+        self.writer.add_torrent(b'hash', 0, 1, 0)
+        self.writer.flush(self.conn)
+        self.assertEqual(self._torrent_stats(), [(b'hash', 1, 11, 20)])
+
+    def test_background_flush_on_stop(self):
+        writer = StatsWriter(':memory:', 60)
+        writer.start()
+        writer.add_torrent(b'hash', 1, 0, 0)
+        writer.stop()
+        self.assertEqual(writer._torrents, {})
@@ -1,17 +1,268 @@
-""" Tracker config """
+""" Tracker config
+
+Config is immutable and resolved once at startup. Values are taken from
+defaults below, overridden by JSON config file, then by environment
+variables WARP_<OPTION NAME>, then by command line options --<option-name>.
+Importing this module does no IO, `cfg` holds defaults only.
+"""
 
 import os
+import json
+import argparse
+from collections import namedtuple
+
+ENV_PREFIX = 'WARP_'
+
+
+class ConfigError(ValueError):
+    """ Raise when config value is invalid """
+    pass
+
+
+Option = namedtuple('Option', 'name type default help')
+
+
+def parse_bool(value):
+    """ Convert config value to bool """
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if str(value).lower() in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError('not a boolean: {!r}'.format(value))
+
+
+def parse_list(value):
+    """ Convert config value to tuple of strings. Strings are comma
+    separated """
+    if isinstance(value, str):
+        return tuple(x.strip() for x in value.split(',') if x.strip())
+    return tuple(value)
+
+
+def optional(convert):
+    """ Make converter accepting None and empty string as None """
+    def convert_optional(value):
+        if value is None or value == '':
+            return None
+        return convert(value)
+    return convert_optional
 
-cfg = {
-    'port': 1717,
-    'bind_addr': '127.0.0.1',
-    'torrents_dir': os.path.join(os.getcwd(), 'torrents'),
-    'announce_url': 'http://127.0.0.1:1717/announce',
+
+OPTIONS = (
+    Option('port', int, 1717, 'port to listen'),
+    Option('bind_addr', str, '127.0.0.1', 'address to listen'),
+    Option('torrents_dir', str, os.path.join(os.getcwd(), 'torrents'),
+           'directory with torrent files'),
+    Option('announce_url', str, 'http://127.0.0.1:1717/announce',
+           'announce url of tracker'),
 
     # Replace announce url in torrent file to given when send to client
-    'patch_announce_url': True,
+    Option('patch_announce_url', parse_bool, True,
+           'replace announce url in served torrent files'),
+
+    # Seconds clients and caches may keep downloaded torrent files
+    Option('metafile_max_age', int, 3600,
+           'max-age of served torrent files in seconds'),
 
     # Interval in seconds that the client should wait between sending
     # regular requests to the tracker
-    'check_interval': 300,
-}
+    Option('check_interval', int, 300, 'announce interval in seconds'),
+
+    # Returned interval is randomized within check_interval +- jitter,
+    # so clients started together spread their announces over time
+    Option('interval_jitter', int, 30,
+           'announce interval randomization in seconds'),
+
+    # Number of peers returned in announce response if client does not
+    # ask for numwant, and maximum number client may ask for
+    Option('numwant', int, 50, 'default number of peers in response'),
+    Option('numwant_max', int, 200, 'maximum number of peers in response'),
+
+    # Peers not announced for peer_ttl seconds are removed from swarms by
+    # background thread every expire_interval seconds
+    Option('peer_ttl', int, 2 * 60 * 60, 'peer lifetime in seconds'),
+    Option('expire_interval', int, 5 * 60,
+           'interval of expired peers cleanup in seconds'),
+
+    # Peer store backend: 'memory' or 'redis'. Redis protocol server
+    # allows several tracker nodes to share swarms. Redis 6.2 or newer
+    # is required, version is checked at startup
+    Option('peer_store', str, 'memory',
+           'peer store backend: memory, redis (Redis 6.2+)'),
+    Option('redis_host', str, '127.0.0.1', 'redis host'),
+    Option('redis_port', int, 6379, 'redis port'),
+    Option('redis_pool_size', int, 8, 'redis idle connections to keep'),
+    Option('redis_timeout', float, 1.0, 'redis socket timeout in seconds'),
+
+    # HTTP serving. New and idle keep-alive connections wait for request
+    # headers in one selector thread, complete requests are handled by
+    # pool of worker threads
+    Option('workers', int, 4, 'request handling threads'),
+    Option('backlog', int, 128, 'listen backlog size'),
+    Option('keepalive_timeout', float, 5.0,
+           'idle keep-alive connection timeout in seconds'),
+
+    # Slow clients protection. Request line with headers and request body
+    # must be received in given time, response must be sent in given time
+    Option('header_timeout', float, 10.0,
+           'request line and headers read timeout in seconds'),
+    Option('body_timeout', float, 10.0, 'request body read timeout'),
+    Option('send_timeout', float, 10.0, 'response send timeout'),
+    Option('max_request_size', int, 8192,
+           'maximum size of request line with headers and of body'),
+    Option('max_connections', int, 1024,
+           'connections over this number are answered with 503'),
+
+    # Path to passkeys file for private tracker mode. Announces are accepted
+    # on <announce_url>/<passkey> only. None disables passkeys check
+    Option('passkeys_file', optional(str), None, 'passkeys file path'),
+
+    # Hex info_hashes tracked without metafile in torrents dir
+    Option('info_hash_whitelist', parse_list, (),
+           'comma separated hex info_hashes tracked without torrent file'),
+
+    # Hex info_hashes rejected even if metafile is loaded
+    Option('info_hash_blacklist', parse_list, (),
+           'comma separated hex info_hashes to reject'),
+
+    # Track any info_hash not in blacklist. Unknown swarms are registered
+    # on first announce, least recently announced are evicted over the limit
+    Option('open_tracker', parse_bool, False, 'track unknown info_hashes'),
+    Option('open_tracker_max_torrents', int, 10000,
+           'maximum number of swarms registered by open tracker'),
+
+    # Path to SQLite database for completions and transfer stats.
+    # None disables stats persistence
+    Option('stats_db', optional(str), None, 'stats database path'),
+
+    # Interval in seconds between writes of accumulated stats to database
+    Option('stats_flush_interval', float, 10.0,
+           'stats database write interval in seconds'),
+
+    # Token for /admin requests. None disables admin requests
+    Option('admin_token', optional(str), None, 'admin requests token'),
+
+    # Announce profiling is toggled by SIGUSR1 or /admin/profile request.
+    # On SIGUSR1 stop collapsed stacks are saved to profile_dir
+    Option('profile_interval', float, 0.005,
+           'stack sampling interval in seconds'),
+    Option('profile_dir', str, os.getcwd(), 'directory for profile dumps'),
+)
+
+
+Config = namedtuple('Config', [x.name for x in OPTIONS])
+
+cfg = Config(**{x.name: x.default for x in OPTIONS})
+
+
+def load_config(argv=None, environ=None):
+    """ Resolve config from config file, environment and command line """
+    args = parse_args(argv)
+    environ = os.environ if environ is None else environ
+
+    values = {}
+    config_file = args.pop('config', None)
+    if config_file is None:
+        config_file = environ.get(ENV_PREFIX + 'CONFIG')
+    if config_file is not None:
+        values.update(read_config_file(config_file))
+    for option in OPTIONS:
+        env_name = ENV_PREFIX + option.name.upper()
+        if env_name in environ:
+            values[option.name] = environ[env_name]
+    values.update(args)
+    return make_config(values)
+
+
+def make_config(values):
+    """ Convert and validate values over defaults. Returns Config """
+    options = {x.name: x for x in OPTIONS}
+    unknown = set(values) - set(options)
+    if unknown:
+        raise ConfigError('Unknown options: {}'.format(
+            ', '.join(sorted(unknown))))
+
+    resolved = {}
+    for option in OPTIONS:
+        value = values.get(option.name, option.default)
+        try:
+            resolved[option.name] = option.type(value)
+        except (TypeError, ValueError) as ex:
+            raise ConfigError('Invalid {}: {}'.format(option.name, ex))
+    config = Config(**resolved)
+    validate(config)
+    return config
+
+
+def validate(config):
+    """ Check values consistency. Raise ConfigError """
+    checks = (
+        (0 <= config.port <= 65535, 'port must be in 0..65535'),
+        (config.workers >= 1, 'workers must be positive'),
+        (config.backlog >= 1, 'backlog must be positive'),
+        (config.keepalive_timeout > 0, 'keepalive_timeout must be positive'),
+        (config.header_timeout > 0, 'header_timeout must be positive'),
+        (config.body_timeout > 0, 'body_timeout must be positive'),
+        (config.send_timeout > 0, 'send_timeout must be positive'),
+        (config.max_request_size >= 1024,
+         'max_request_size must be at least 1024'),
+        (config.max_connections >= 1, 'max_connections must be positive'),
+        (config.check_interval > 0, 'check_interval must be positive'),
+        (0 <= config.interval_jitter < config.check_interval,
+         'interval_jitter must be in 0..check_interval'),
+        (0 <= config.numwant <= config.numwant_max,
+         'numwant must be in 0..numwant_max'),
+        (config.peer_ttl > 0, 'peer_ttl must be positive'),
+        (config.expire_interval > 0, 'expire_interval must be positive'),
+        (config.stats_flush_interval > 0,
+         'stats_flush_interval must be positive'),
+        (config.profile_interval > 0, 'profile_interval must be positive'),
+        (config.open_tracker_max_torrents >= 1,
+         'open_tracker_max_torrents must be positive'),
+        (config.peer_store in ('memory', 'redis'),
+         'peer_store must be memory or redis'),
+    )
+    for passed, msg in checks:
+        if not passed:
+            raise ConfigError(msg)
+
+    for name in ('info_hash_whitelist', 'info_hash_blacklist'):
+        for info_hash in getattr(config, name):
+            if len(info_hash) != 40 or not is_hex(info_hash):
+                raise ConfigError('Invalid info_hash {} in {}'.format(
+                    info_hash, name))
+
+
+def read_config_file(path):
+    """ Read JSON config file to dictionary """
+    try:
+        with open(path) as file:
+            values = json.load(file)
+    except (OSError, ValueError) as ex:
+        raise ConfigError('Can not read config file {}: {}'.format(path, ex))
+    if not isinstance(values, dict):
+        raise ConfigError('Config file {} is not an object'.format(path))
+    return values
+
+
+def parse_args(argv):
+    """ Parse command line options. Returns only options given """
+    parser = argparse.ArgumentParser(
+        description='Warp BitTorrent tracker',
+        argument_default=argparse.SUPPRESS)
+    parser.add_argument('-c', '--config', help='JSON config file path')
+    for option in OPTIONS:
+        parser.add_argument('--{}'.format(option.name.replace('_', '-')),
+                            dest=option.name, help=option.help)
+    return vars(parser.parse_args(argv))
+
+
+def is_hex(value):
+    """ Check if string is hexadecimal """
+    try:
+        int(value, 16)
+    except ValueError:
+        return False
+    return True
@@ -2,11 +2,19 @@
 """
 import os
 import logging
-import datetime
+import time
+import random
 import hashlib
+import threading
+from collections import OrderedDict
 
 from warp import bencode
-from warp.lib import Singleton
+from warp.lib import Singleton, atomic_write
+from warp.passkeys import PasskeyStore
+from warp.peer_store import create_peer_store
+from warp.profiler import profiler
+from warp.redis_client import RedisError
+from warp.stats import StatsWriter
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -22,28 +30,122 @@ class TorrentNotFound(Exception):
     pass
 
 
+# Seconds since last announce while peer is considered alive
+PEER_ALIVE_TIME = 2 * 60 * 60
+
+# Failure responses are encoded once, rejecting needs no allocations
+NOT_REGISTERED_RESPONSE = bencode.encode({
+    b'failure reason': b'Torrent not registered',
+    b'failure code': 200
+})
+
+INVALID_PASSKEY_RESPONSE = bencode.encode({
+    b'failure reason': b'Invalid passkey',
+    b'failure code': 202
+})
+
+UNAVAILABLE_RESPONSE = bencode.encode({
+    b'failure reason': b'Tracker temporarily unavailable',
+    b'failure code': 900
+})
+
+
 class WarpCore(metaclass=Singleton):
     """ Core of tracker """
     def __init__(self, cfg):
         super().__init__()
         self.cfg = cfg
+        self.announce_url = cfg.announce_url.encode('utf-8')
         self.hashes_torrents = {}
         self.torrents = set()
+        self.passkeys = None
+        self.stats = None
+        self.whitelist = hex_to_hashes(cfg.info_hash_whitelist)
+        self.blacklist = hex_to_hashes(cfg.info_hash_blacklist)
+        # Swarms of whitelisted info_hashes, never evicted
+        self.whitelisted_swarms = {}
+        # Swarms registered by open tracker in least recently announced order
+        self.swarms = OrderedDict()
+        self._swarms_lock = threading.Lock()
+        self.peer_store = create_peer_store(cfg)
+        self._expire_stop = threading.Event()
+        self._expire_thread = None
+
+    def load_passkeys(self):
+        """ Loading passkeys if private mode is enabled """
+        path = self.cfg.passkeys_file
+        if path is None:
+            return
+        if self.passkeys is None:
+            self.passkeys = PasskeyStore(path)
+        self.passkeys.load()
+
+    def start_stats(self):
+        """ Start stats persistence if stats database is configured """
+        path = self.cfg.stats_db
+        if path is None or self.stats is not None:
+            return
+        self.stats = StatsWriter(path, self.cfg.stats_flush_interval)
+        self.stats.start()
+        logger.info('Writing stats to %s', path)
+
+    def stop_stats(self):
+        """ Flush pending stats and stop stats persistence """
+        if self.stats is not None:
+            self.stats.stop()
+            self.stats = None
+
+    def start_expiry(self):
+        """ Start background thread removing expired peers """
+        if self._expire_thread is not None:
+            return
+        self._expire_stop.clear()
+        self._expire_thread = threading.Thread(
+            target=self._expire_loop, name='PeerExpiry', daemon=True)
+        self._expire_thread.start()
+
+    def stop_expiry(self):
+        """ Stop expired peers cleanup thread """
+        self._expire_stop.set()
+        if self._expire_thread is not None:
+            self._expire_thread.join()
+            self._expire_thread = None
+
+    def _expire_loop(self):
+        while not self._expire_stop.wait(self.cfg.expire_interval):
+            try:
+                self.expire_peers()
+            except Exception:
+                logger.exception('Expired peers cleanup failed')
+
+    def check_passkey(self, passkey):
+        """ Check passkey if private mode is enabled """
+        return self.passkeys is None or self.passkeys.is_valid(passkey)
+
+    def get_announce_url(self, passkey=None):
+        """ Return announce url for user with given passkey """
+        if passkey is None:
+            return self.announce_url
+        return b'%b/%b' % (self.announce_url, passkey)
 
     def load_torrents(self):
         """ Loading torrents from files """
-        torrents_dir = self.cfg['torrents_dir']
+        torrents_dir = self.cfg.torrents_dir
         logger.info('Loading torrents from %s', torrents_dir)
         for file_path in find_files(torrents_dir):
-            torrent = Torrent.init_from_file(file_path)
+            self.load_torrent(file_path)
+        logger.info('Loaded %i torrents', len(self.hashes_torrents))
 
-            if self.cfg['patch_announce_url']:
-                url = self.cfg['announce_url'].encode('utf-8')
-                torrent.patch_announce_url(url)
+    def load_torrent(self, file_path):
+        """ Load torrent from file and start serving it """
+        torrent = Torrent.init_from_file(file_path)
 
-            self.add_torrent(torrent)
-            self.add_hash_torrent(torrent.info_hash, torrent)
-        logger.info('Loaded %i torrents', len(self.hashes_torrents))
+        if self.cfg.patch_announce_url:
+            torrent.patch_announce_url(self.announce_url)
+
+        self.add_torrent(torrent)
+        self.add_hash_torrent(torrent.info_hash, torrent)
+        return torrent
 
     def add_hash_torrent(self, info_hash, torrent):
         """ Serve torrent """
@@ -59,14 +161,73 @@ class WarpCore(metaclass=Singleton):
         """ Return serving torrents view """
         return self.hashes_torrents.values()
 
+    def is_info_hash_allowed(self, info_hash):
+        """ Cheap check of raw info_hash before announce processing """
+        if info_hash in self.blacklist:
+            return False
+        return (info_hash in self.hashes_torrents or
+                info_hash in self.whitelist or
+                self.cfg.open_tracker)
+
     def get_torrent_by_hash(self, info_hash):
         """ Return torent by info hash """
         try:
             return self.hashes_torrents[info_hash]
         except KeyError:
-            msg = 'Torrent not found for info_hash {}'.format(info_hash)
-            logger.info(msg)
-            raise InfoHashNotFound(msg)
+            pass
+
+        if info_hash in self.blacklist:
+            pass
+        elif info_hash in self.whitelist:
+            return self.get_whitelisted_swarm(info_hash)
+        elif self.cfg.open_tracker:
+            return self.get_swarm(info_hash)
+
+        msg = 'Torrent not found for info_hash {}'.format(info_hash)
+        logger.info(msg)
+        raise InfoHashNotFound(msg)
+
+    def get_whitelisted_swarm(self, info_hash):
+        """ Return swarm of whitelisted info_hash """
+        with self._swarms_lock:
+            swarm = self.whitelisted_swarms.get(info_hash)
+            if swarm is None:
+                swarm = self.whitelisted_swarms[info_hash] = Swarm(info_hash)
+        return swarm
+
+    def get_swarm(self, info_hash):
+        """ Return swarm registered by open tracker, registering unknown
+        ones. Least recently announced swarm is evicted over
+        open_tracker_max_torrents """
+        with self._swarms_lock:
+            swarm = self.swarms.get(info_hash)
+            if swarm is not None:
+                self.swarms.move_to_end(info_hash)
+                return swarm
+
+            swarm = Swarm(info_hash)
+            self.swarms[info_hash] = swarm
+            if len(self.swarms) <= self.cfg.open_tracker_max_torrents:
+                return swarm
+            evicted_hash, evicted = self.swarms.popitem(last=False)
+
+        try:
+            self.peer_store.drop(evicted_hash)
+        except RedisError as ex:
+            # Redis keys of swarm expire by themselves
+            logger.error('Can not drop %s: %s', evicted, ex)
+        logger.debug('Evict %s', evicted)
+        return swarm
+
+    def expire_peers(self):
+        """ Remove peers not announced for peer_ttl from all swarms """
+        expired = 0
+        with self._swarms_lock:
+            info_hashes = (list(self.hashes_torrents) +
+                           list(self.whitelisted_swarms) + list(self.swarms))
+        for info_hash in info_hashes:
+            expired += self.peer_store.expire(info_hash, self.cfg.peer_ttl)
+        logger.info('Expired %i peers', expired)
 
     def get_torrent_by_file_name(self, file_name):
         """ Return torrent by filename """
@@ -80,48 +241,93 @@ class WarpCore(metaclass=Singleton):
 
     def announce(self, params):
         """ Announce response. Returns bencoded dictionary """
-        peer = Peer(params)
+        passkey = params.get('passkey')
+        if not self.check_passkey(passkey):
+            return INVALID_PASSKEY_RESPONSE
 
         info_hash = params['info_hash']
+        if not self.is_info_hash_allowed(info_hash):
+            return NOT_REGISTERED_RESPONSE
+
         try:
-            torrent = self.get_torrent_by_hash(info_hash)
-            torrent.add_peer(peer)
-            peers = torrent.get_peers()
-            response = {
-                b'interval': self.cfg['check_interval'],
-                # b'tracker id': b'WarpTracker',
-                # b'complete': len([p for p in peers if p.is_seeder]),
-                # b'incomplete': len([p for p in peers if p.is_leecher]),
-                b'peers': b''.join([p.as_bytes_compact for p in peers])
-            }
+            self.get_torrent_by_hash(info_hash)
         except InfoHashNotFound:
-            response = {
-                b'failure reason': b'Torrent not registered',
-                b'failure code': 200
-            }
+            return NOT_REGISTERED_RESPONSE
+
+        with profiler.stage('Peer'):
+            peer = Peer(params)
 
-        logger.debug('Response: %s', bencode.encode(response))
-        return bencode.encode(response)
+        numwant = self.get_numwant(params.get('numwant'))
 
+        try:
+            with profiler.stage('peer_store'):
+                stopped = params.get('event') == b'stopped'
+                previous, peers, (complete, incomplete) = \
+                    self.peer_store.announce(info_hash, peer, stopped,
+                                             numwant)
+        except RedisError as ex:
+            logger.error('Peer store error: %s', ex)
+            return UNAVAILABLE_RESPONSE
+        self.account(params, peer, previous)
+        response = {
+            b'interval': self.get_interval(),
+            # b'tracker id': b'WarpTracker',
+            b'complete': complete,
+            b'incomplete': incomplete,
+            b'peers': b''.join([p.as_bytes_compact for p in peers])
+        }
+
+        with profiler.stage('bencode.encode'):
+            encoded = bencode.encode(response)
+        logger.debug('Response: %s', encoded)
+        return encoded
+
+    def get_numwant(self, value):
+        """ Number of peers asked by client clamped to 0..numwant_max.
+        Missing or malformed value gives default numwant """
+        try:
+            numwant = int(value)
+        except (TypeError, ValueError):
+            return self.cfg.numwant
+        return max(0, min(numwant, self.cfg.numwant_max))
+
+    def get_interval(self):
+        """ Announce interval randomized by interval_jitter """
+        jitter = self.cfg.interval_jitter
+        return self.cfg.check_interval + random.randint(-jitter, jitter)
+
+    def account(self, params, peer, previous):
+        """ Account transfer and completion of announcing peer in stats.
+        User transfer is accounted in private mode """
+        if self.stats is None:
+            return
+        uploaded, downloaded = transfer_delta(peer, previous)
+        completed = int(params.get('event') == b'completed')
+        self.stats.add_torrent(
+            params['info_hash'], completed, uploaded, downloaded)
+        if self.passkeys is not None:
+            user = self.passkeys.get_user(params.get('passkey'))
+            if user is not None:
+                self.stats.add_user(user, uploaded, downloaded)
+
+
+class Swarm(object):
+    """ Torrent known by info_hash only. Peers are kept in peer store """
+    def __init__(self, info_hash):
+        self.info_hash = info_hash
+
+    def __repr__(self):
+        return 'Swarm({})'.format(self.info_hash.hex())
 
-class Torrent(object):
+
+class Torrent(Swarm):
     """ Torrent object """
     def __init__(self, meta_file):
         self._meta_file = meta_file
         self.file_name = meta_file.file_name
-        self.info_hash = self.create_info_hash()
-        self.peers = set()
+        super().__init__(self.create_info_hash())
         logger.debug('Init %s', self)
 
-    def add_peer(self, peer):
-        """ Add peer to torrent """
-        self.peers.discard(peer)
-        self.peers.add(peer)
-
-    def get_peers(self):
-        """ Returns iterable with peers """
-        return self.peers
-
     def create_info_hash(self):
         """ Creating info_hash from bencoded info block from metafile """
         return hash_sha1(self._meta_file.bencoded_info)
@@ -135,9 +341,14 @@ class Torrent(object):
         """ Replace announce url in torrent to url """
         self._meta_file.meta_data[b'announce'] = url
 
-    def get_meta_file_content(self):
-        """ Returns metafile content in bytes"""
-        return self._meta_file.bencoded_meta_data
+    def get_meta_file_content(self, announce_url=None):
+        """ Returns metafile content in bytes. If announce_url is given
+        it is used instead of announce url of metafile """
+        if announce_url is None:
+            return self._meta_file.bencoded_meta_data
+        meta_data = dict(self._meta_file.meta_data)
+        meta_data[b'announce'] = announce_url
+        return bencode.encode(meta_data)
 
     def __repr__(self):
         return 'Torrent({})'.format(self._meta_file)
@@ -154,7 +365,7 @@ class TorrentMetaFile(object):
 
     def dump_to_file(self):
         """ Save meta_info to a file """
-        pass
+        atomic_write(self.path, self.bencoded_meta_data)
 
     @property
     def bencoded_meta_data(self):
@@ -186,7 +397,9 @@ class Peer(object):
         self.port = int(params['port'])
         self.left = int(params['left'])
         self.compact = int(params['compact'])
-        self.last_seen = datetime.datetime.now()
+        self.uploaded = int(params.get('uploaded', 0))
+        self.downloaded = int(params.get('downloaded', 0))
+        self.last_seen = time.time()
         logger.debug('Init %s', self)
 
     @property
@@ -217,8 +430,7 @@ class Peer(object):
     @property
     def alive(self):
         """ Check alive state of peer """
-        alive_time = datetime.timedelta(hours=2)
-        return self.last_seen > datetime.datetime.now() + alive_time
+        return time.time() - self.last_seen < PEER_ALIVE_TIME
 
     def __repr__(self):
         return 'Peer({}, {}, {})'.format(self.peer_id, self.host, self.port)
@@ -238,10 +450,29 @@ def find_files(dir_path):
         logger.error('Directory does not exists %s', dir_path)
         exit(1)
 
-    file_paths = [os.path.join(dir_path, p) for p in file_names]
+    # Hidden files are skipped, they may be not yet written torrents
+    file_paths = [os.path.join(dir_path, p) for p in file_names
+                  if not p.startswith('.')]
     return file_paths
 
 
+def transfer_delta(peer, previous):
+    """ Return (uploaded, downloaded) since previous announce of peer.
+    Counters of new or restarted client are taken as is """
+    if previous is None:
+        return peer.uploaded, peer.downloaded
+    uploaded = peer.uploaded - previous.uploaded
+    downloaded = peer.downloaded - previous.downloaded
+    if uploaded < 0 or downloaded < 0:
+        return peer.uploaded, peer.downloaded
+    return uploaded, downloaded
+
+
+def hex_to_hashes(hex_hashes):
+    """ Convert list of hex info_hashes to set of raw info_hashes """
+    return {bytes.fromhex(x) for x in hex_hashes}
+
+
 def hash_sha1(byte_str):
     """ Return sha1 hash of byte string """
     sha1 = hashlib.sha1()
@@ -1,11 +1,24 @@
 """ Web server related module """
 
+import io
+import hmac
+import gzip
+import time
+import socket
+import hashlib
 import logging
+import selectors
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from urllib.parse import urlparse, _coerce_args, unquote_to_bytes
+from urllib.parse import quote_from_bytes
 
-import warp.config
-from warp.core import WarpCore
+from warp.core import NOT_REGISTERED_RESPONSE
+from warp.passkeys import MAX_PASSKEY_LENGTH
+from warp.profiler import profiler
 from warp.base import Server
 
 logger = logging.getLogger(__name__)
@@ -13,6 +26,23 @@ logger.setLevel(logging.DEBUG)
 
 MAX_VALUE_LENGTH = 20
 
+# Number of encoded public metafiles kept in memory
+METAFILE_CACHE_SIZE = 1024
+
+# Bytes read from socket at once
+RECV_SIZE = 8192
+
+# Seconds between checks of waiting connections deadlines
+SWEEP_INTERVAL = 0.1
+
+# Sent to connections over max_connections without reading request
+BUSY_RESPONSE = (b'HTTP/1.1 503 Service Unavailable\r\n'
+                 b'Content-Length: 0\r\n'
+                 b'Retry-After: 5\r\n'
+                 b'Connection: close\r\n\r\n')
+
+MetaFileEntity = namedtuple('MetaFileEntity', 'content gzipped etag gzip_etag')
+
 PAGE_TEMPLATE = """<!DOCTYPE html>
 <html lang="en">
     <head>
@@ -29,14 +59,260 @@ PAGE_TEMPLATE = """<!DOCTYPE html>
 """
 
 
+class RangeNotSatisfiable(Exception):
+    """ Raise when requested byte range is out of content """
+    pass
+
+
+class RequestTooLarge(Exception):
+    """ Raise when request exceeds max_request_size """
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class DeadlineSocketIO(io.RawIOBase):
+    """ Socket reader with deadline for whole request instead of timeout
+    for each recv, so slow client can not hold connection by sending
+    request byte by byte """
+    def __init__(self, sock):
+        super().__init__()
+        self.sock = sock
+        self.deadline = None
+
+    def readable(self):
+        return True
+
+    def set_deadline(self, timeout):
+        """ Finish reading in timeout from now """
+        self.deadline = time.monotonic() + timeout
+
+    def readinto(self, buf):
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout('read deadline exceeded')
+        self.sock.settimeout(remaining)
+        return self.sock.recv_into(buf)
+
+
+class RequestReader(object):
+    """ Buffered request reader limiting request line and headers size.
+    Reading starts from data already received by RequestWaiter, data
+    left unread is kept in buffer for next request of connection """
+    def __init__(self, sock, data=b''):
+        self.raw = DeadlineSocketIO(sock)
+        self.buffer = bytearray(data)
+        self.left = 0
+
+    def start(self, timeout, max_size):
+        """ Start reading of next request """
+        self.raw.set_deadline(timeout)
+        self.left = max_size
+
+    def _fill(self):
+        """ Read more data to buffer. Returns False on end of stream """
+        data = self.raw.read(RECV_SIZE)
+        self.buffer += data
+        return bool(data)
+
+    def readline(self, size=-1):
+        """ Read line. Raise RequestTooLarge over request size limit """
+        limit = self.left + 1 if size < 0 else min(size, self.left + 1)
+        while True:
+            end = self.buffer.find(b'\n', 0, limit)
+            if end >= 0:
+                end += 1
+                break
+            if len(self.buffer) >= limit or not self._fill():
+                end = limit
+                break
+        line = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        self.left -= len(line)
+        if self.left < 0:
+            raise RequestTooLarge(431)
+        return line
+
+    def read_body(self, size, timeout):
+        """ Read request body in timeout """
+        self.raw.set_deadline(timeout)
+        while len(self.buffer) < size and self._fill():
+            pass
+        body = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return body
+
+    def close(self):
+        """ Close reader, socket is left open """
+        self.raw.close()
+
+
+class WaitingConnection(object):
+    """ Accepted connection with data received so far """
+    def __init__(self, sock, client_address, data=b''):
+        self.sock = sock
+        self.client_address = client_address
+        self.buffer = bytearray(data)
+        self.idle = False
+        self.deadline = None
+
+
+class RequestWaiter(object):
+    """ Waits in one selector thread until request line and headers of
+    connection are received. New, slow and idle keep-alive connections
+    do not hold worker threads, complete requests are passed to on_ready.
+    Connections closed by client or out of time are passed to on_close """
+    def __init__(self, cfg, on_ready, on_close):
+        self.cfg = cfg
+        self.on_ready = on_ready
+        self.on_close = on_close
+        self.selector = selectors.DefaultSelector()
+        self._added = []
+        self._lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        """ Start selector thread """
+        self._thread = threading.Thread(
+            target=self._run, name='RequestWaiter', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop selector thread and close waiting connections """
+        self._stopping = True
+        self._wakeup()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for key in list(self.selector.get_map().values()):
+            if key.data is not None:
+                self.on_close(key.data.sock)
+        with self._lock:
+            added, self._added = self._added, []
+        for conn in added:
+            self.on_close(conn.sock)
+        self.selector.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+    def add(self, conn, keepalive=False):
+        """ Wait for request of connection. Connection kept alive after
+        response is idle for keepalive_timeout until next request starts.
+        May be called from any thread """
+        conn.idle = keepalive and not conn.buffer
+        timeout = self.cfg.header_timeout
+        if conn.idle:
+            timeout = self.cfg.keepalive_timeout
+        conn.deadline = time.monotonic() + timeout
+        if self.is_ready(conn):
+            self.on_ready(conn)
+            return
+        with self._lock:
+            self._added.append(conn)
+        self._wakeup()
+
+    def is_ready(self, conn):
+        """ Check if headers are received or request is too large """
+        return (len(conn.buffer) > self.cfg.max_request_size or
+                headers_received(conn.buffer))
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except OSError:
+            # Wakeup is pending already if socket buffer is full
+            pass
+
+    def _register_added(self):
+        try:
+            while self._wakeup_r.recv(RECV_SIZE):
+                pass
+        except OSError:
+            pass
+        with self._lock:
+            added, self._added = self._added, []
+        for conn in added:
+            conn.sock.setblocking(False)
+            self.selector.register(conn.sock, selectors.EVENT_READ, conn)
+
+    def _run(self):
+        next_sweep = time.monotonic() + SWEEP_INTERVAL
+        while not self._stopping:
+            for key, _ in self.selector.select(SWEEP_INTERVAL):
+                if key.data is None:
+                    self._register_added()
+                else:
+                    self._receive(key.data)
+            now = time.monotonic()
+            if now >= next_sweep:
+                next_sweep = now + SWEEP_INTERVAL
+                self._close_expired(now)
+
+    def _receive(self, conn):
+        try:
+            data = conn.sock.recv(RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close(conn)
+            return
+        if conn.idle:
+            conn.idle = False
+            conn.deadline = time.monotonic() + self.cfg.header_timeout
+        conn.buffer += data
+        if self.is_ready(conn):
+            self.selector.unregister(conn.sock)
+            conn.sock.setblocking(True)
+            self.on_ready(conn)
+
+    def _close_expired(self, now):
+        expired = [key.data for key in self.selector.get_map().values()
+                   if key.data is not None and key.data.deadline <= now]
+        for conn in expired:
+            self._close(conn)
+
+    def _close(self, conn):
+        self.selector.unregister(conn.sock)
+        self.on_close(conn.sock)
+
+
+class Response(object):
+    """ Response with status and additional headers """
+    def __init__(self, content_type, body, status=200, headers=None):
+        self.content_type = content_type
+        self.body = body
+        self.status = status
+        self.headers = headers or []
+
+    def __repr__(self):
+        return 'Response({}, {})'.format(self.status, self.content_type)
+
+
 class ServerRequest(object):
     """ Server request handlers class """
-    def __init__(self, request, host):
-        self.core = WarpCore(warp.config.cfg)
+    def __init__(self, server, request, host, headers=None):
+        self.server = server
+        self.core = server.core
         self.request = request
         self.host = host
-        self.query = parse_qs_to_bytes(self.request.query)
-        logger.debug('%s query %s', self, self.query)
+        self.headers = headers if headers is not None else {}
+        self._query = None
+
+    @property
+    def query(self):
+        """ Parsed query. Parsing is postponed until first use """
+        if self._query is None:
+            with profiler.stage('parse_qs_to_bytes'):
+                self._query = parse_qs_to_bytes(self.request.query)
+            logger.debug('%s query %s', self, self._query)
+        return self._query
 
     def process(self):
         """ Process request method """
@@ -53,60 +329,205 @@ class UnknownRequest(ServerRequest):
 
 
 class AnnounceRequest(ServerRequest):
-    """ Announce request """
+    """ Announce request. Path may be followed by user passkey:
+    /announce/<passkey> """
     def process(self):
+        with profiler.sampled():
+            return self.announce()
+
+    def announce(self):
+        """ Parse announce and return core response """
+        content_type = 'text/plain'
+        # Reject unknown torrents before parsing whole query
+        info_hash = query_value(self.request.query, 'info_hash')
+        if (info_hash is None or
+                not self.core.is_info_hash_allowed(trim(info_hash))):
+            return content_type, NOT_REGISTERED_RESPONSE
+
         params = {
+            'passkey': path_passkey(self.request.path,
+                                    self.server.announce_path),
             'peer_id': trim(self.query[b'peer_id'][0]),
             'info_hash': trim(self.query[b'info_hash'][0]),
             'host': trim(self.host.encode('utf-8')),
             'port': trim(self.query[b'port'][0]),
             'left': trim(self.query[b'left'][0]),
             'compact': trim(self.query[b'compact'][0]),
+            'uploaded': trim(self.query.get(b'uploaded', [b'0'])[0]),
+            'downloaded': trim(self.query.get(b'downloaded', [b'0'])[0]),
+            'event': trim(self.query.get(b'event', [b''])[0]),
+            'numwant': trim(self.query.get(b'numwant', [b''])[0]),
         }
-        content_type = 'text/plain'
-        return content_type, self.core.announce(params)
+        with profiler.stage('WarpCore.announce'):
+            return content_type, self.core.announce(params)
+
+
+class AdminRequest(ServerRequest):
+    """ Admin requests, enabled if admin_token is set. Token is passed in
+    X-Admin-Token header only, query string gets to request log.
+    /admin/profile?action=start|stop|dump|stages """
+    def process(self):
+        cfg = self.core.cfg
+        if cfg.admin_token is None:
+            return 'text/plain', 'Unknown request'
+
+        token = self.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(token.encode('utf-8'),
+                                   cfg.admin_token.encode('utf-8')):
+            return Response('text/plain', 'Forbidden', 403)
+
+        if self.request.path.rstrip('/') != '/admin/profile':
+            return Response('text/plain', 'Not found', 404)
+
+        action = self.query.get(b'action', [b'stages'])[0]
+        if action == b'start':
+            profiler.start(cfg.profile_interval)
+            return 'text/plain', 'Profiling started\n'
+        elif action == b'stop':
+            profiler.stop()
+            return 'text/plain', profiler.stages_report()
+        elif action == b'dump':
+            return 'text/plain', profiler.collapsed()
+        elif action == b'stages':
+            return 'text/plain', profiler.stages_report()
+        return Response('text/plain', 'Unknown action', 400)
 
 
 class TorrentListRequest(ServerRequest):
-    """ Torrent list request """
+    """ Torrent list request. Passkey in query is passed to file links """
     def process(self):
         f_names = [x.file_name for x in self.core.get_torrents()]
-        links = ['<a href="/files/{0}">{0}</a>'.format(x) for x in f_names]
+        suffix = ''
+        passkey = passkey_value(self.query.get(b'passkey', [None])[0])
+        if passkey is not None:
+            suffix = '?passkey={}'.format(quote_from_bytes(passkey))
+        links = ['<a href="/files/{0}{1}">{0}</a>'.format(x, suffix)
+                 for x in f_names]
         page = PAGE_TEMPLATE.format('<br /><br />'.join(links))
         return 'text/html', page
 
 
 class TorrentRequest(ServerRequest):
-    """ Return torrent Metafile to user """
+    """ Return torrent Metafile to user. If passkey is given in query
+    announce url is replaced with personal announce url of user.
+    Public metafiles are cached encoded and gzipped, personal ones are
+    encoded per request. Conditional and range requests are supported """
     def process(self):
         elems = self.request.path.split('/')
         if len(elems) != 3:
             raise Exception('Wrong path: {}'.format(self.request.path))
         file_name = elems[-1]
         torrent = self.core.get_torrent_by_file_name(file_name)
-        return 'application/x-bittorrent', torrent.get_meta_file_content()
+
+        announce_url = None
+        cache_control = 'public'
+        if b'passkey' in self.query:
+            passkey = passkey_value(self.query[b'passkey'][0])
+            if passkey is None or not self.core.check_passkey(passkey):
+                return Response('text/plain', 'Invalid passkey', 403)
+            announce_url = self.core.get_announce_url(passkey)
+            cache_control = 'private'
+        cache_control = '{}, max-age={}'.format(
+            cache_control, self.core.cfg.metafile_max_age)
+
+        entity = metafile_entity(torrent, announce_url)
+        return entity_response('application/x-bittorrent', entity,
+                               self.headers, cache_control)
 
 
 class HTTPRequestHandler(BaseHTTPRequestHandler):
-    """ BaseHTTPRequestHandler subclass """
-    def __init__(self, request, client_address, server):
+    """ BaseHTTPRequestHandler subclass handling one request of
+    WaitingConnection. Request line and headers are already received,
+    they are read with size limit. Connection to keep alive is returned
+    to RequestWaiter by server """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        conn = self.request
+        self.request = conn.sock
+        super().setup()
+        self.rfile.close()
+        self.rfile = RequestReader(self.connection, conn.buffer)
+        # Used by send_error if request line is not parsed
+        self.requestline = ''
+        self.request_version = 'HTTP/1.0'
+        self.command = None
+
+    def handle(self):
+        self.close_connection = True
+        cfg = self.server.cfg
+        self.rfile.start(cfg.header_timeout, cfg.max_request_size)
+        try:
+            self.handle_one_request()
+        except RequestTooLarge as ex:
+            self.close_connection = True
+            self.send_error(ex.status)
+
+    def skip_body(self):
+        """ Read and drop request body if any, tracker accepts none """
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > self.server.cfg.max_request_size:
+            raise RequestTooLarge(413)
+        if length > 0:
+            self.rfile.read_body(length, self.server.cfg.body_timeout)
+
+    def answer(self):
+        """ Answer to requested path """
+        request = urlparse(self.path)
+        host, _ = self.client_address
+        handler = self.server.get_request_handler(request)
+        response = handler(self.server, request, host, self.headers).process()
+        if not isinstance(response, Response):
+            response = Response(*response)
+        return response
+
+    def do_GET(self):
+        """ GET query response """
+        self.skip_body()
+        response = self.answer()
+        body = response_to_bytes(response.body)
+        self.connection.settimeout(self.server.cfg.send_timeout)
+        self.send_response(response.status)
+        if response.content_type is not None:
+            self.send_header('Content-type', response.content_type)
+        if response.status != 304:
+            self.send_header('Content-Length', len(body))
+        for name, value in response.headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TrackerHTTPServer(HTTPServer):
+    """ HTTPServer holding tracker core and config. Accepted connections
+    wait for complete request in RequestWaiter, then request is handled
+    by pool of worker threads. Connections over max_connections are
+    rejected right after accept """
+    def __init__(self, cfg, core):
+        self.cfg = cfg
+        self.core = core
+        self.announce_path = urlparse(cfg.announce_url).path
+        self.request_queue_size = cfg.backlog
+
         self.requests = {}
-        self.register_server_request(AnnounceRequest, announce_path())
+        self.register_server_request(AnnounceRequest, self.announce_path)
         self.register_server_request(TorrentListRequest, '/')
         self.register_server_request(TorrentRequest, '/files')
-        super().__init__(request, client_address, server)
+        self.register_server_request(AdminRequest, '/admin')
+
+        self.connections = 0
+        self._connections_lock = threading.Lock()
+
+        self.executor = ThreadPoolExecutor(cfg.workers)
+        self.waiter = RequestWaiter(cfg, self.submit_request,
+                                    self.release_request)
+        super().__init__((cfg.bind_addr, cfg.port), HTTPRequestHandler)
+        self.waiter.start()
 
     def register_server_request(self, request_cls, url):
         """ Register server request """
         self.requests[url] = request_cls
 
-    def answer(self):
-        """ Answer to requested path """
-        request = urlparse(self.path)
-        host, _ = self.client_address
-        handler = self.get_request_handler(request)
-        return handler(request, host).process()
-
     def get_request_handler(self, request):
         """ Find suitable request handler based on path """
         try:
@@ -115,26 +536,68 @@ class HTTPRequestHandler(BaseHTTPRequestHandler):
         except KeyError:
             return UnknownRequest
 
-    def do_GET(self):
-        """ GET query response """
-        content_type, response = self.answer()
-        self.send_response(200)
-        self.send_header('Content-type', content_type)
-        self.end_headers()
-        self.wfile.write(response_to_bytes(response))
+    def process_request(self, request, client_address):
+        with self._connections_lock:
+            busy = self.connections >= self.cfg.max_connections
+            if not busy:
+                self.connections += 1
+        if busy:
+            self.reject_request(request)
+        else:
+            self.waiter.add(WaitingConnection(request, client_address))
+
+    def submit_request(self, conn):
+        """ Handle received request in worker thread """
+        self.executor.submit(self.process_request_worker, conn)
+
+    def process_request_worker(self, conn):
+        """ Handle one request of connection. Connection to keep alive
+        is returned to waiter """
+        handler = None
+        try:
+            handler = self.RequestHandlerClass(conn, conn.client_address,
+                                               self)
+        except Exception:
+            self.handle_error(conn.sock, conn.client_address)
+        if handler is None or handler.close_connection:
+            self.release_request(conn.sock)
+            return
+        conn.buffer = handler.rfile.buffer
+        self.waiter.add(conn, keepalive=True)
+
+    def release_request(self, request):
+        """ Close connection and release its slot """
+        self.shutdown_request(request)
+        with self._connections_lock:
+            self.connections -= 1
+
+    def reject_request(self, request):
+        """ Answer 503 without blocking and close connection """
+        try:
+            request.setblocking(False)
+            request.send(BUSY_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.waiter.stop()
+        self.executor.shutdown(wait=False)
 
 
 class WarpHTTPServer(Server):
     """ HTTP server class """
-    def __init__(self, cfg):
+    def __init__(self, cfg, core):
         super().__init__()
         self.cfg = cfg
+        self.core = core
 
     def serve(self):
+        http_server = TrackerHTTPServer(self.cfg, self.core)
         try:
-            params = (self.cfg['bind_addr'], self.cfg['port'])
-            logger.info('Starting http server on %s:%s', *params)
-            http_server = HTTPServer(params, HTTPRequestHandler)
+            logger.info('Starting http server on %s:%s',
+                        self.cfg.bind_addr, self.cfg.port)
             http_server.serve_forever()
         except KeyboardInterrupt:
             logger.info('Shutting down http server')
@@ -222,6 +685,134 @@ def parse_qsl_to_bytes(query_string, keep_blank_values=False,
     return res
 
 
+def query_value(query_string, name):
+    """ Return first unquoted value of name from query string or None """
+    prefix = name + '='
+    for pair in query_string.split('&'):
+        if pair.startswith(prefix):
+            return unquote_to_bytes(pair[len(prefix):].replace('+', ' '))
+    return None
+
+
+def metafile_entity(torrent, announce_url=None):
+    """ Metafile entity with personal announce_url or public one. Only
+    public entities are cached, personal ones are built per request
+    without gzipped variant """
+    if announce_url is None:
+        return public_metafile_entity(torrent)
+    return build_metafile_entity(
+        torrent.get_meta_file_content(announce_url), compress=False)
+
+
+@lru_cache(maxsize=METAFILE_CACHE_SIZE)
+def public_metafile_entity(torrent):
+    """ Public metafile entity cached per torrent """
+    return build_metafile_entity(torrent.get_meta_file_content())
+
+
+def build_metafile_entity(content, compress=True):
+    """ Encode metafile with its gzipped variant and strong etags """
+    digest = hashlib.sha1(content).hexdigest()
+    return MetaFileEntity(
+        content=content,
+        gzipped=gzip.compress(content) if compress else None,
+        etag='"{}"'.format(digest),
+        gzip_etag='"{}-gzip"'.format(digest),
+    )
+
+
+def entity_response(content_type, entity, headers, cache_control):
+    """ Build response for entity according to request headers """
+    range_header = headers.get('Range')
+    use_gzip = (range_header is None and entity.gzipped is not None and
+                accepts_gzip(headers.get('Accept-Encoding', '')))
+    etag = entity.gzip_etag if use_gzip else entity.etag
+    resp_headers = [
+        ('ETag', etag),
+        ('Cache-Control', cache_control),
+        ('Vary', 'Accept-Encoding'),
+        ('Accept-Ranges', 'bytes'),
+    ]
+
+    if etag_matches(headers.get('If-None-Match'), etag):
+        return Response(None, b'', 304, resp_headers)
+
+    if use_gzip:
+        resp_headers.append(('Content-Encoding', 'gzip'))
+        return Response(content_type, entity.gzipped, 200, resp_headers)
+
+    content = entity.content
+    try:
+        byte_range = parse_range(range_header, len(content))
+    except RangeNotSatisfiable:
+        resp_headers.append(
+            ('Content-Range', 'bytes */{}'.format(len(content))))
+        return Response(None, b'', 416, resp_headers)
+
+    if byte_range is None:
+        return Response(content_type, content, 200, resp_headers)
+
+    start, end = byte_range
+    resp_headers.append(
+        ('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(content))))
+    return Response(content_type, content[start:end + 1], 206, resp_headers)
+
+
+def accepts_gzip(accept_encoding):
+    """ Check if gzip is acceptable by Accept-Encoding header value """
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() not in ('gzip', '*'):
+            continue
+        param, _, value = params.partition('=')
+        if param.strip() != 'q':
+            return True
+        try:
+            return float(value) > 0
+        except ValueError:
+            return False
+    return False
+
+
+def etag_matches(if_none_match, etag):
+    """ Weak comparison of If-None-Match header value with etag """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = [x.strip() for x in if_none_match.split(',')]
+    return etag in [x[2:] if x.startswith('W/') else x for x in tags]
+
+
+def parse_range(range_header, length):
+    """ Return (start, end) of single byte range inclusively or None if
+    range should be ignored. Raise RangeNotSatisfiable for ranges out
+    of content """
+    if range_header is None:
+        return None
+    unit, _, ranges = range_header.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        return None
+    first, sep, last = ranges.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable(range_header)
+            return max(length - suffix, 0), length - 1
+        start = int(first)
+        end = int(last) if last else length - 1
+    except ValueError:
+        return None
+    if start >= length:
+        raise RangeNotSatisfiable(range_header)
+    if start > end:
+        return None
+    return start, min(end, length - 1)
+
+
 def response_to_bytes(string):
     """ Convert response string to bytes if needed """
     if string is not None:
@@ -233,6 +824,11 @@ def response_to_bytes(string):
         return bytes()
 
 
+def headers_received(data):
+    """ Check if request line and headers are received completely """
+    return b'\r\n\r\n' in data or b'\n\n' in data
+
+
 def trim(value):
     """ Trim value for safety """
     if len(value) > MAX_VALUE_LENGTH:
@@ -241,7 +837,17 @@ def trim(value):
         return value
 
 
-def announce_path():
-    """ Get announce path from config """
-    announce_url = warp.config.cfg['announce_url']
-    return urlparse(announce_url).path
+def path_passkey(path, announce_path):
+    """ Get passkey following announce path or None """
+    passkey = path[len(announce_path):].strip('/')
+    if not passkey:
+        return None
+    return passkey_value(unquote_to_bytes(passkey))
+
+
+def passkey_value(value):
+    """ Return passkey or None if value is empty or too long to be one.
+    Passkeys are not trimmed, cut passkey would never match """
+    if not value or len(value) > MAX_PASSKEY_LENGTH:
+        return None
+    return value
@@ -2,7 +2,10 @@
 warp-tracker - lib
 """
 
+import os
+import stat
 import logging
+import tempfile
 import threading
 
 logger = logging.getLogger(__name__)
@@ -21,3 +24,32 @@ class Singleton(type):
                 logger.debug('Creating new instance')
                 cls._instances[cls] = super().__call__(*args, **kwargs)
         return cls._instances[cls]
+
+
+def atomic_write(path, data):
+    """ Write data to path via temporary file in the same directory.
+    Readers never see partially written file """
+    dir_path, file_name = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix='.{}.'.format(
+        file_name))
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        # mkstemp creates file readable by owner only
+        os.chmod(tmp_path, file_mode(path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def file_mode(path):
+    """ Permissions of existing file or default permissions of new one """
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
@@ -4,11 +4,17 @@
 distributing under GNU General Public License
 """
 
+import sys
 import logging
+import signal
+import threading
 
 from warp.core import WarpCore
-from warp.config import cfg
+from warp.config import load_config, ConfigError
 from warp.http_server import WarpHTTPServer
+from warp.profiler import profiler
+
+logger = logging.getLogger(__name__)
 
 
 def set_logger():
@@ -25,14 +31,38 @@ def set_logger():
         root.addHandler(log_handler)
 
 
-def run_server():
+def toggle_profiler(cfg):
+    """ Start profiler or stop it and save collected stacks """
+    if not profiler.toggle(cfg.profile_interval):
+        profiler.dump(cfg.profile_dir)
+        logger.info('Announce stages:\n%s', profiler.stages_report())
+
+
+def on_sigusr1(cfg):
+    """ Toggle profiler in separate thread. Stopping joins sampler thread
+    which may wait for profiler lock held by interrupted thread """
+    threading.Thread(target=toggle_profiler, args=(cfg,),
+                     name='ProfilerToggle').start()
+
+
+def run_server(cfg):
     """ Init and run server """
     core = WarpCore(cfg)
     core.load_torrents()
-    server = WarpHTTPServer(cfg)
+    core.load_passkeys()
+    signal.signal(signal.SIGHUP, lambda *_: core.load_passkeys())
+    signal.signal(signal.SIGUSR1, lambda *_: on_sigusr1(cfg))
+    core.start_stats()
+    core.start_expiry()
+    server = WarpHTTPServer(cfg, core)
     server.serve()
+    core.stop_expiry()
+    core.stop_stats()
 
 
 if __name__ == '__main__':
     set_logger()
-    run_server()
+    try:
+        run_server(load_config())
+    except ConfigError as ex:
+        sys.exit('Config error: {}'.format(ex))
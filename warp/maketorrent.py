@@ -0,0 +1,289 @@
+#!/usr/bin/env python3.5
+
+""" Create torrent metafiles for files and directories
+
+Pieces are hashed by streamed fixed-size reads into a reused buffer.
+Piece spans are hashed in parallel by process pool.
+"""
+
+import os
+import sys
+import time
+import argparse
+import hashlib
+import logging
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from warp import bencode
+from warp.config import load_config, ConfigError
+from warp.lib import atomic_write
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+MIN_PIECE_LENGTH = 2 ** 14
+MAX_PIECE_LENGTH = 2 ** 24
+
+# Piece length is chosen to get about this number of pieces
+TARGET_PIECES = 1500
+
+# Number of pieces hashed by one pool task
+PIECES_PER_TASK = 64
+
+CREATED_BY = b'warp-tracker'
+
+
+class EmptyContent(ValueError):
+    """ Raise when there is no data to create torrent for """
+    pass
+
+
+class ConcatReader(object):
+    """ Read sequence of files as one stream """
+    def __init__(self, files):
+        self.files = files
+        self._index = 0
+        self._file = None
+
+    def seek(self, offset):
+        """ Move to offset of concatenated stream """
+        self.close()
+        for index, (path, size) in enumerate(self.files):
+            if offset < size:
+                break
+            offset -= size
+        else:
+            index = len(self.files)
+        self._index = index
+        if index < len(self.files):
+            self._file = open(self.files[index][0], 'rb')
+            self._file.seek(offset)
+
+    def readinto(self, view):
+        """ Fill view from stream, crossing file boundaries.
+        Returns number of bytes read """
+        filled = 0
+        while filled < len(view) and self._index < len(self.files):
+            if self._file is None:
+                self._file = open(self.files[self._index][0], 'rb')
+            read = self._file.readinto(view[filled:])
+            if not read:
+                self._file.close()
+                self._file = None
+                self._index += 1
+            filled += read
+        return filled
+
+    def close(self):
+        """ Close current file """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def collect_files(path):
+    """ Return list of (path, size, path elements) of files to share """
+    if os.path.isfile(path):
+        return [(path, os.path.getsize(path), [os.path.basename(path)])]
+
+    files = []
+    for root, dirs, file_names in os.walk(path):
+        dirs.sort()
+        for file_name in sorted(file_names):
+            file_path = os.path.join(root, file_name)
+            elems = os.path.relpath(file_path, path).split(os.sep)
+            files.append((file_path, os.path.getsize(file_path), elems))
+    return files
+
+
+def auto_piece_length(total_size):
+    """ Return power of 2 piece length for given content size """
+    piece_length = MIN_PIECE_LENGTH
+    while (piece_length < MAX_PIECE_LENGTH and
+           total_size // piece_length > TARGET_PIECES):
+        piece_length *= 2
+    return piece_length
+
+
+def hash_span(files, offset, length, piece_length):
+    """ Return concatenated sha1 digests of pieces in span of stream """
+    buf = memoryview(bytearray(piece_length))
+    digests = []
+    with ConcatReader(files) as reader:
+        reader.seek(offset)
+        while length > 0:
+            size = reader.readinto(buf[:min(piece_length, length)])
+            if not size:
+                raise IOError('Unexpected end of data at {}'.format(offset))
+            digests.append(hashlib.sha1(buf[:size]).digest())
+            offset += size
+            length -= size
+    return b''.join(digests)
+
+
+def split_spans(files, piece_length):
+    """ Return arguments of hash_span for spans of PIECES_PER_TASK pieces """
+    total_size = sum(size for _, size in files)
+    span_length = piece_length * PIECES_PER_TASK
+    return [(files, offset, min(span_length, total_size - offset),
+             piece_length) for offset in range(0, total_size, span_length)]
+
+
+def hashing_processes(span_count, workers=None):
+    """ Number of processes hashing span_count spans """
+    workers = workers or os.cpu_count() or 1
+    return max(1, min(workers, span_count))
+
+
+def hash_pieces(files, piece_length, workers=None):
+    """ Return pieces hashes of files. Spans of pieces are hashed in
+    process pool if more than one process would be used """
+    spans = split_spans(files, piece_length)
+    processes = hashing_processes(len(spans), workers)
+
+    if processes == 1:
+        return b''.join(hash_span(*span) for span in spans)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return b''.join(executor.map(hash_span, *zip(*spans)))
+
+
+def create_torrent(path, announce_url, piece_length=None, workers=None,
+                   private=False, comment=None):
+    """ Create metafile data for file or directory """
+    path = os.path.abspath(path)
+    files = collect_files(path)
+    total_size = sum(size for _, size, _ in files)
+    if total_size == 0:
+        raise EmptyContent('No data to share in {}'.format(path))
+    if piece_length is None:
+        piece_length = auto_piece_length(total_size)
+
+    logger.info('Hashing %i bytes in %i files', total_size, len(files))
+    pieces = hash_pieces([(p, size) for p, size, _ in files],
+                         piece_length, workers)
+
+    info = {
+        b'name': os.path.basename(path).encode('utf-8'),
+        b'piece length': piece_length,
+        b'pieces': pieces,
+    }
+    if os.path.isfile(path):
+        info[b'length'] = total_size
+    else:
+        info[b'files'] = [
+            {b'length': size, b'path': [x.encode('utf-8') for x in elems]}
+            for _, size, elems in files]
+    if private:
+        info[b'private'] = 1
+
+    meta_data = {
+        b'announce': announce_url,
+        b'info': info,
+        b'creation date': int(time.time()),
+        b'created by': CREATED_BY,
+    }
+    if comment:
+        meta_data[b'comment'] = comment.encode('utf-8')
+    return meta_data
+
+
+def write_torrent(meta_data, torrents_dir, file_name=None):
+    """ Atomically write metafile to torrents dir. Returns path """
+    if file_name is None:
+        file_name = '{}.torrent'.format(
+            meta_data[b'info'][b'name'].decode('utf-8'))
+    path = os.path.join(torrents_dir, file_name)
+    atomic_write(path, bencode.encode(meta_data))
+    return path
+
+
+def benchmark(size_mb, piece_length, workers):
+    """ Hash temporary file of size_mb and report throughput """
+    block = os.urandom(2 ** 20)
+    with tempfile.NamedTemporaryFile() as file:
+        for _ in range(size_mb):
+            file.write(block)
+        file.flush()
+
+        files = [(file.name, size_mb * 2 ** 20)]
+        started = time.perf_counter()
+        hash_pieces(files, piece_length, workers)
+        elapsed = time.perf_counter() - started
+
+    # Only processes actually hashing are counted, small data may be
+    # hashed by fewer processes than workers
+    processes = hashing_processes(
+        len(split_spans(files, piece_length)), workers)
+    throughput = size_mb / elapsed
+    print('{} MB in {:.2f} s: {:.1f} MB/s, {:.1f} MB/s per core '
+          '({} processes)'.format(size_mb, elapsed, throughput,
+                                  throughput / processes, processes))
+
+
+def parse_args(argv, environ=None):
+    """ Parse command line arguments. Announce url and torrents dir
+    default to tracker config resolved from config file and environment """
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0].strip())
+    parser.add_argument('path', nargs='?',
+                        help='file or directory to create torrent for')
+    parser.add_argument('--config', help='tracker JSON config file path')
+    parser.add_argument('-a', '--announce-url',
+                        help='announce url, announce_url of config by default')
+    parser.add_argument('-o', '--torrents-dir',
+                        help='output dir, torrents_dir of config by default')
+    parser.add_argument('-l', '--piece-length', type=int,
+                        help='piece length in bytes, power of 2')
+    parser.add_argument('-w', '--workers', type=int,
+                        help='hashing processes, number of CPUs by default')
+    parser.add_argument('-p', '--private', action='store_true')
+    parser.add_argument('-c', '--comment')
+    parser.add_argument('--benchmark', type=int, metavar='MB',
+                        help='report hashing throughput for MB of data')
+    args = parser.parse_args(argv)
+    if args.path is None and args.benchmark is None:
+        parser.error('path is required')
+
+    try:
+        config = load_config(
+            [] if args.config is None else ['--config', args.config],
+            environ)
+    except ConfigError as ex:
+        parser.error('config error: {}'.format(ex))
+    if args.announce_url is None:
+        args.announce_url = config.announce_url
+    if args.torrents_dir is None:
+        args.torrents_dir = config.torrents_dir
+    return args
+
+
+def main(argv=None):
+    """ Command line entry point """
+    args = parse_args(argv)
+    if args.benchmark is not None:
+        benchmark(args.benchmark, args.piece_length or 2 ** 18, args.workers)
+        return
+
+    try:
+        meta_data = create_torrent(
+            args.path, args.announce_url.encode('utf-8'), args.piece_length,
+            args.workers, args.private, args.comment)
+    except EmptyContent as ex:
+        # Usage error, exit status as of argparse errors
+        sys.stderr.write('maketorrent: error: {}\n'.format(ex))
+        sys.exit(2)
+    path = write_torrent(meta_data, args.torrents_dir)
+    logger.info('Torrent saved to %s', path)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
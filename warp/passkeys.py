@@ -0,0 +1,61 @@
+""" Passkey authentication for private tracker mode
+
+Passkeys file format, one user per line:
+  <passkey> [<user name>]
+
+Empty lines and lines started with '#' are ignored. If user name is
+omitted the passkey itself is used as a user name. Passkeys longer than
+MAX_PASSKEY_LENGTH are skipped.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+MAX_PASSKEY_LENGTH = 64
+
+
+class PasskeyStore(object):
+    """ Passkey to user lookup table. User transfer is accounted by
+    stats writer """
+    def __init__(self, path):
+        self.path = path
+        self.users = {}
+
+    def load(self):
+        """ (Re)load passkeys from file. Old table is kept on error """
+        try:
+            users = read_passkeys(self.path)
+        except OSError as ex:
+            logger.error('Can not load passkeys from %s: %s', self.path, ex)
+            return
+        # Swap whole table at once, lookups never see half loaded table
+        self.users = users
+        logger.info('Loaded %i passkeys', len(users))
+
+    def get_user(self, passkey):
+        """ Return user name for passkey or None """
+        return self.users.get(passkey)
+
+    def is_valid(self, passkey):
+        """ Check if passkey is registered """
+        return passkey in self.users
+
+
+def read_passkeys(path):
+    """ Read passkeys file to dictionary passkey -> user """
+    users = {}
+    with open(path, 'rb') as file:
+        for line in file:
+            elems = line.split()
+            if not elems or elems[0].startswith(b'#'):
+                continue
+            passkey = elems[0]
+            if len(passkey) > MAX_PASSKEY_LENGTH:
+                logger.warning('Skip passkey longer than %i bytes: %s',
+                               MAX_PASSKEY_LENGTH, passkey)
+                continue
+            user = elems[1] if len(elems) > 1 else passkey
+            users[passkey] = user
+    return users
@@ -0,0 +1,340 @@
+""" Peer storage backends
+
+Peers are stored per info_hash. Peer identity is its compact address,
+so announce from the same host and port replaces previous peer.
+"""
+
+import re
+import time
+import random
+import logging
+import threading
+
+from warp import bencode
+from warp.config import ConfigError
+from warp.redis_client import ConnectionPool, RedisError
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# HRANDFIELD used for peers sampling is available since Redis 6.2
+MIN_REDIS_VERSION = (6, 2)
+
+
+class PeerStore(object):
+    """ Peer store interface """
+    def upsert(self, info_hash, peer):
+        """ Add or replace peer. Returns replaced peer or None """
+        raise NotImplementedError
+
+    def remove(self, info_hash, peer):
+        """ Remove peer from swarm. Returns removed peer or None """
+        raise NotImplementedError
+
+    def drop(self, info_hash):
+        """ Remove all peers of swarm """
+        raise NotImplementedError
+
+    def sample(self, info_hash, count):
+        """ Returns list of at most count random peers """
+        raise NotImplementedError
+
+    def counts(self, info_hash):
+        """ Returns (seeders, leechers) numbers """
+        raise NotImplementedError
+
+    def expire(self, info_hash, max_age):
+        """ Remove peers not seen for max_age seconds.
+        Returns number of removed peers """
+        raise NotImplementedError
+
+    def announce(self, info_hash, peer, stopped, count):
+        """ Upsert peer, or remove it if stopped, then sample count peers
+        and count swarm. Returns (previous peer, peers, (seeders, leechers)).
+        Backends override it to do all in one operation """
+        if stopped:
+            previous = self.remove(info_hash, peer)
+        else:
+            previous = self.upsert(info_hash, peer)
+        return (previous, self.sample(info_hash, count),
+                self.counts(info_hash))
+
+
+class MemorySwarm(object):
+    """ Peers of one swarm. Peers list with index allows sampling without
+    copying swarm, seeders counter is updated on every change """
+    def __init__(self):
+        self.peers = []
+        self.index = {}
+        self.seeders = 0
+
+    def upsert(self, peer):
+        """ Add or replace peer. Returns replaced peer or None """
+        position = self.index.get(peer)
+        if position is None:
+            self.index[peer] = len(self.peers)
+            self.peers.append(peer)
+            previous = None
+        else:
+            previous = self.peers[position]
+            self.peers[position] = peer
+            self.seeders -= previous.is_seeder
+        self.seeders += peer.is_seeder
+        return previous
+
+    def remove(self, peer):
+        """ Remove peer. Returns removed peer or None """
+        position = self.index.pop(peer, None)
+        if position is None:
+            return None
+        removed = self.peers[position]
+        last = self.peers.pop()
+        if position < len(self.peers):
+            self.peers[position] = last
+            self.index[last] = position
+        self.seeders -= removed.is_seeder
+        return removed
+
+    def sample(self, count):
+        """ Returns list of at most count random peers """
+        if len(self.peers) <= count:
+            return list(self.peers)
+        return random.sample(self.peers, count)
+
+    def counts(self):
+        """ Returns (seeders, leechers) numbers """
+        return self.seeders, len(self.peers) - self.seeders
+
+
+class MemoryPeerStore(PeerStore):
+    """ Peers in dictionaries of current process """
+    def __init__(self):
+        self.swarms = {}
+        self._lock = threading.Lock()
+
+    def upsert(self, info_hash, peer):
+        with self._lock:
+            swarm = self.swarms.get(info_hash)
+            if swarm is None:
+                swarm = self.swarms[info_hash] = MemorySwarm()
+            return swarm.upsert(peer)
+
+    def remove(self, info_hash, peer):
+        with self._lock:
+            swarm = self.swarms.get(info_hash)
+            return swarm.remove(peer) if swarm is not None else None
+
+    def drop(self, info_hash):
+        with self._lock:
+            self.swarms.pop(info_hash, None)
+
+    def sample(self, info_hash, count):
+        if count <= 0:
+            return []
+        with self._lock:
+            swarm = self.swarms.get(info_hash)
+            return swarm.sample(count) if swarm is not None else []
+
+    def counts(self, info_hash):
+        with self._lock:
+            swarm = self.swarms.get(info_hash)
+            return swarm.counts() if swarm is not None else (0, 0)
+
+    def announce(self, info_hash, peer, stopped, count):
+        with self._lock:
+            swarm = self.swarms.get(info_hash)
+            if swarm is None:
+                if stopped:
+                    return None, [], (0, 0)
+                swarm = self.swarms[info_hash] = MemorySwarm()
+            if stopped:
+                previous = swarm.remove(peer)
+            else:
+                previous = swarm.upsert(peer)
+            peers = swarm.sample(count) if count > 0 else []
+            return previous, peers, swarm.counts()
+
+    def expire(self, info_hash, max_age):
+        deadline = time.time() - max_age
+        with self._lock:
+            swarm = self.swarms.get(info_hash)
+            if swarm is None:
+                return 0
+            expired = [p for p in swarm.peers if p.last_seen < deadline]
+            for peer in expired:
+                swarm.remove(peer)
+        return len(expired)
+
+
+class RedisPeerStore(PeerStore):
+    """ Peers in Redis protocol server shared by tracker nodes.
+    Seeders and leechers of swarm are kept in two hashes
+    field compact address -> bencoded peer, so counts are O(1) """
+    def __init__(self, host, port, pool_size=8, timeout=None,
+                 prefix=b'warp:peers:', swarm_ttl=None):
+        self.pool = ConnectionPool(host, port, pool_size, timeout)
+        self.prefix = prefix
+        self.swarm_ttl = swarm_ttl
+
+    def server_version(self):
+        """ Return (major, minor) version of Redis server """
+        info = self.pool.execute(b'INFO', b'server')
+        match = re.search(rb'^redis_version:(\d+)\.(\d+)', info, re.M)
+        if match is None:
+            raise RedisError('No redis_version in INFO reply')
+        return int(match.group(1)), int(match.group(2))
+
+    def _keys(self, info_hash):
+        key = self.prefix + info_hash
+        return key + b':seeders', key + b':leechers'
+
+    def _change_commands(self, info_hash, peer, stopped):
+        """ Commands getting previous peer, then upserting or removing """
+        seeders, leechers = self._keys(info_hash)
+        field = peer.as_bytes_compact
+        commands = [
+            (b'HGET', seeders, field),
+            (b'HGET', leechers, field),
+        ]
+        if stopped:
+            commands += [
+                (b'HDEL', seeders, field),
+                (b'HDEL', leechers, field),
+            ]
+            return commands
+        target, other = (seeders, leechers) if peer.is_seeder else \
+            (leechers, seeders)
+        commands += [
+            (b'HSET', target, field, peer_to_bytes(peer)),
+            (b'HDEL', other, field),
+        ]
+        if self.swarm_ttl is not None:
+            commands.append((b'EXPIRE', target, self.swarm_ttl))
+        return commands
+
+    def upsert(self, info_hash, peer):
+        replies = self.pool.pipeline(
+            self._change_commands(info_hash, peer, False))
+        return previous_peer(replies)
+
+    def remove(self, info_hash, peer):
+        replies = self.pool.pipeline(
+            self._change_commands(info_hash, peer, True))
+        return previous_peer(replies)
+
+    def announce(self, info_hash, peer, stopped, count):
+        """ Whole announce in one pipeline, one round trip """
+        keys = self._keys(info_hash)
+        commands = self._change_commands(info_hash, peer, stopped)
+        changes = len(commands)
+        if count > 0:
+            commands += [(b'HRANDFIELD', key, count, b'WITHVALUES')
+                         for key in keys]
+        commands += [(b'HLEN', key) for key in keys]
+        replies = self.pool.pipeline(commands)
+        peers = []
+        if count > 0:
+            peers = sample_replies(replies[changes:changes + 2], count)
+        return previous_peer(replies), peers, tuple(replies[-2:])
+
+    def drop(self, info_hash):
+        self.pool.execute(b'DEL', *self._keys(info_hash))
+
+    def sample(self, info_hash, count):
+        if count <= 0:
+            return []
+        replies = self.pool.pipeline([
+            (b'HRANDFIELD', key, count, b'WITHVALUES')
+            for key in self._keys(info_hash)])
+        return sample_replies(replies, count)
+
+    def counts(self, info_hash):
+        seeders, leechers = self.pool.pipeline([
+            (b'HLEN', key) for key in self._keys(info_hash)])
+        return seeders, leechers
+
+    def expire(self, info_hash, max_age):
+        keys = self._keys(info_hash)
+        replies = self.pool.pipeline([(b'HGETALL', key) for key in keys])
+        deadline = time.time() - max_age
+        commands = []
+        for key, reply in zip(keys, replies):
+            fields = [field for field, value in zip(reply[::2], reply[1::2])
+                      if peer_from_bytes(value).last_seen < deadline]
+            if fields:
+                commands.append((b'HDEL', key) + tuple(fields))
+        if commands:
+            self.pool.pipeline(commands)
+        return sum(len(x) - 2 for x in commands)
+
+
+def check_redis_version(store):
+    """ Raise ConfigError if Redis server is older than MIN_REDIS_VERSION.
+    Unavailable server is only logged, announces fail until it is up """
+    try:
+        version = store.server_version()
+    except RedisError as ex:
+        logger.warning('Can not check Redis server version: %s', ex)
+        return
+    if version < MIN_REDIS_VERSION:
+        raise ConfigError('Redis {} or newer is required, server is {}'.format(
+            '.'.join(map(str, MIN_REDIS_VERSION)),
+            '.'.join(map(str, version))))
+
+
+def previous_peer(replies):
+    """ Previous peer from replies of HGET of seeders and leechers """
+    previous = replies[0] or replies[1]
+    return peer_from_bytes(previous) if previous else None
+
+
+def sample_replies(replies, count):
+    """ At most count peers from HRANDFIELD WITHVALUES replies of seeders
+    and leechers """
+    values = [v for reply in replies for v in (reply or [])[1::2]]
+    if len(values) > count:
+        values = random.sample(values, count)
+    return [peer_from_bytes(x) for x in values]
+
+
+def create_peer_store(cfg):
+    """ Create peer store configured by cfg """
+    if cfg.peer_store == 'memory':
+        return MemoryPeerStore()
+    elif cfg.peer_store == 'redis':
+        store = RedisPeerStore(
+            cfg.redis_host, cfg.redis_port, cfg.redis_pool_size,
+            cfg.redis_timeout, swarm_ttl=cfg.peer_ttl)
+        check_redis_version(store)
+        return store
+    raise ValueError('Unknown peer store {}'.format(cfg.peer_store))
+
+
+def peer_to_bytes(peer):
+    """ Serialize peer """
+    return bencode.encode({
+        b'peer id': peer.peer_id,
+        b'ip': peer.host,
+        b'port': peer.port,
+        b'left': peer.left,
+        b'uploaded': peer.uploaded,
+        b'downloaded': peer.downloaded,
+        b'last seen': int(peer.last_seen),
+    })
+
+
+def peer_from_bytes(data):
+    """ Deserialize peer """
+    from warp.core import Peer  # core imports this module
+    fields = bencode.decode(data)
+    peer = Peer({
+        'peer_id': fields[b'peer id'],
+        'host': fields[b'ip'],
+        'port': fields[b'port'],
+        'left': fields[b'left'],
+        'compact': 1,
+        'uploaded': fields[b'uploaded'],
+        'downloaded': fields[b'downloaded'],
+    })
+    peer.last_seen = fields[b'last seen']
+    return peer
@@ -0,0 +1,210 @@
+""" Opt-in profiler of announce handling
+
+Stage timers accumulate count, total and max time of named stages.
+Sampler thread periodically takes stacks of threads inside sampled
+sections and counts them in collapsed format, one "frame;frame;... count"
+line per stack, ready for flamegraph tools. When profiler is disabled
+stages and sections cost one attribute check.
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+
+from warp.lib import atomic_write
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+DEFAULT_INTERVAL = 0.005
+
+# Thread switch interval while profiling. Default 5ms interval rarely
+# lets sampler run in the middle of sub-millisecond announce
+SWITCH_INTERVAL = 0.0001
+
+
+class NullContext(object):
+    """ Context manager doing nothing, used when profiler is disabled """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_CONTEXT = NullContext()
+
+
+class Stage(object):
+    """ Measure time of stage """
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add_stage_time(
+            self.name, time.perf_counter() - self.started)
+
+
+class SampledSection(object):
+    """ Mark current thread to be sampled """
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.thread_id = threading.get_ident()
+
+    def __enter__(self):
+        with self.profiler._lock:
+            self.profiler._active.add(self.thread_id)
+        return self
+
+    def __exit__(self, *exc_info):
+        with self.profiler._lock:
+            self.profiler._active.discard(self.thread_id)
+
+
+class Profiler(object):
+    """ Stage timers and stack sampler """
+    def __init__(self):
+        self.enabled = False
+        self.interval = DEFAULT_INTERVAL
+        self.stages = {}
+        self.stacks = {}
+        self._active = set()
+        # Never taken in signal handlers, SIGUSR1 toggles profiler in thread
+        self._lock = threading.Lock()
+        # Serializes start and stop, they may come from signal thread and
+        # admin requests at once
+        self._state_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._switch_interval = None
+
+    def start(self, interval=None):
+        """ Reset collected data and start profiling """
+        with self._state_lock:
+            self._start(interval)
+
+    def stop(self):
+        """ Stop profiling. Collected data is kept until next start """
+        with self._state_lock:
+            self._stop_sampling()
+
+    def toggle(self, interval=None):
+        """ Start or stop profiling. Returns True if started """
+        with self._state_lock:
+            if self.enabled:
+                self._stop_sampling()
+                return False
+            self._start(interval)
+            return True
+
+    def _start(self, interval):
+        if self.enabled:
+            return
+        if interval is not None:
+            self.interval = interval
+        with self._lock:
+            self.stages = {}
+            self.stacks = {}
+        self._stop.clear()
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, SWITCH_INTERVAL))
+        self._thread = threading.Thread(
+            target=self._run, name='Profiler', daemon=True)
+        self._thread.start()
+        self.enabled = True
+        logger.info('Profiling started, sampling every %s s', self.interval)
+
+    def _stop_sampling(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        sys.setswitchinterval(self._switch_interval)
+        logger.info('Profiling stopped')
+
+    def stage(self, name):
+        """ Context manager measuring named stage """
+        if not self.enabled:
+            return NULL_CONTEXT
+        return Stage(self, name)
+
+    def sampled(self):
+        """ Context manager marking code to be sampled """
+        if not self.enabled:
+            return NULL_CONTEXT
+        return SampledSection(self)
+
+    def add_stage_time(self, name, elapsed):
+        """ Account stage time """
+        with self._lock:
+            stat = self.stages.get(name)
+            if stat is None:
+                self.stages[name] = [1, elapsed, elapsed]
+            else:
+                stat[0] += 1
+                stat[1] += elapsed
+                stat[2] = max(stat[2], elapsed)
+
+    def collapsed(self):
+        """ Return sampled stacks in collapsed format """
+        with self._lock:
+            stacks = sorted(self.stacks.items(), key=lambda x: -x[1])
+        return ''.join('{} {}\n'.format(*x) for x in stacks)
+
+    def stages_report(self):
+        """ Return stage timers as text table """
+        with self._lock:
+            stages = sorted(self.stages.items())
+        lines = ['{:<24} {:>8} {:>12} {:>10} {:>10}'.format(
+            'stage', 'count', 'total ms', 'avg us', 'max us')]
+        for name, (count, total, longest) in stages:
+            lines.append('{:<24} {:>8} {:>12.3f} {:>10.1f} {:>10.1f}'.format(
+                name, count, total * 1e3, total / count * 1e6, longest * 1e6))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, dir_path):
+        """ Write collapsed stacks to file in dir_path. Returns path """
+        file_name = 'warp-profile-{}.folded'.format(
+            time.strftime('%Y%m%d-%H%M%S'))
+        path = os.path.join(dir_path, file_name)
+        atomic_write(path, self.collapsed().encode('utf-8'))
+        logger.info('Profile saved to %s', path)
+        return path
+
+    def _run(self):
+        sampler_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                active = list(self._active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            stacks = [collapse_stack(frames[x]) for x in active
+                      if x in frames and x != sampler_id]
+            with self._lock:
+                for stack in stacks:
+                    self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+
+def collapse_stack(frame):
+    """ Return stack of frame as root first 'file:function;...' string """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{}:{}'.format(
+            os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+profiler = Profiler()
@@ -0,0 +1,129 @@
+""" Minimal Redis protocol (RESP) client with pipelining and pooling """
+
+import socket
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class RedisError(Exception):
+    """ Error reply from server or broken connection """
+    pass
+
+
+class RedisConnection(object):
+    """ Single connection to Redis protocol server """
+    def __init__(self, host, port, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+
+    def execute(self, *args):
+        """ Execute one command and return reply """
+        return self.pipeline([args])[0]
+
+    def pipeline(self, commands):
+        """ Send all commands in one write, then read all replies.
+        Error replies are raised after all replies are read """
+        self.sock.sendall(b''.join(encode_command(x) for x in commands))
+        replies = [self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def close(self):
+        """ Close connection """
+        self.reader.close()
+        self.sock.close()
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise RedisError('Connection closed')
+        kind, data = line[:1], line[1:-2]
+
+        if kind == b'+':
+            return data
+        elif kind == b'-':
+            return RedisError(data.decode('utf-8', 'replace'))
+        elif kind == b':':
+            return int(data)
+        elif kind == b'$':
+            length = int(data)
+            if length < 0:
+                return None
+            return self.reader.read(length + 2)[:-2]
+        elif kind == b'*':
+            length = int(data)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError('Unknown reply type {!r}'.format(line))
+
+
+class ConnectionPool(object):
+    """ Pool of idle connections. Connections are created on demand,
+    at most max_idle connections are kept open """
+    def __init__(self, host, port, max_idle=8, timeout=None):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def pipeline(self, commands):
+        """ Execute commands pipeline on pooled connection """
+        conn = self._acquire()
+        try:
+            replies = conn.pipeline(commands)
+        except (OSError, RedisError) as ex:
+            # Connection state is unknown after error, drop it
+            conn.close()
+            if isinstance(ex, RedisError):
+                raise
+            raise RedisError(str(ex))
+        self._release(conn)
+        return replies
+
+    def execute(self, *args):
+        """ Execute one command on pooled connection """
+        return self.pipeline([args])[0]
+
+    def close(self):
+        """ Close idle connections """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        try:
+            return RedisConnection(self.host, self.port, self.timeout)
+        except OSError as ex:
+            raise RedisError(str(ex))
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+
+def encode_command(args):
+    """ Encode command as RESP array of bulk strings """
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode('utf-8')
+        elif isinstance(arg, int):
+            arg = b'%d' % arg
+        parts.append(b'$%d\r\n%b\r\n' % (len(arg), arg))
+    return b''.join(parts)
@@ -0,0 +1,153 @@
+""" Write-behind persistence of swarm statistics
+
+Announces only accumulate deltas in memory. Background thread flushes
+them to SQLite database in one transaction per interval.
+"""
+
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS torrent_stats (
+    info_hash BLOB PRIMARY KEY,
+    completed INTEGER NOT NULL DEFAULT 0,
+    uploaded INTEGER NOT NULL DEFAULT 0,
+    downloaded INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS user_stats (
+    user BLOB PRIMARY KEY,
+    uploaded INTEGER NOT NULL DEFAULT 0,
+    downloaded INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Upsert as insert of zero row and update, ON CONFLICT clause needs
+# SQLite 3.24 which is newer than SQLite bundled with some Python 3.5
+INSERT_TORRENT = """
+INSERT OR IGNORE INTO torrent_stats
+    (info_hash, completed, uploaded, downloaded)
+VALUES (?, 0, 0, 0)
+"""
+
+UPDATE_TORRENT = """
+UPDATE torrent_stats SET
+    completed = completed + ?,
+    uploaded = uploaded + ?,
+    downloaded = downloaded + ?
+WHERE info_hash = ?
+"""
+
+INSERT_USER = """
+INSERT OR IGNORE INTO user_stats (user, uploaded, downloaded)
+VALUES (?, 0, 0)
+"""
+
+UPDATE_USER = """
+UPDATE user_stats SET
+    uploaded = uploaded + ?,
+    downloaded = downloaded + ?
+WHERE user = ?
+"""
+
+
+class StatsWriter(object):
+    """ Accumulates stats deltas and flushes them in background """
+    def __init__(self, path, flush_interval):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._torrents = {}
+        self._users = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_torrent(self, info_hash, completed, uploaded, downloaded):
+        """ Account torrent stats delta """
+        if not (completed or uploaded or downloaded):
+            return
+        with self._lock:
+            merge(self._torrents, info_hash, (completed, uploaded, downloaded))
+
+    def add_user(self, user, uploaded, downloaded):
+        """ Account user transfer delta """
+        if not (uploaded or downloaded):
+            return
+        with self._lock:
+            merge(self._users, user, (uploaded, downloaded))
+
+    def start(self):
+        """ Start background flushing thread """
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='StatsWriter', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop flushing thread. Pending deltas are flushed before exit """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def connect(self):
+        """ Open database and create tables """
+        conn = sqlite3.connect(self.path)
+        conn.executescript(SCHEMA)
+        return conn
+
+    def flush(self, conn):
+        """ Write accumulated deltas in one transaction. On error deltas
+        are returned back to be written with next flush """
+        with self._lock:
+            torrents, self._torrents = self._torrents, {}
+            users, self._users = self._users, {}
+        if not (torrents or users):
+            return
+
+        try:
+            with conn:
+                conn.executemany(INSERT_TORRENT, [(x,) for x in torrents])
+                conn.executemany(UPDATE_TORRENT, [
+                    tuple(value) + (key,) for key, value in torrents.items()])
+                conn.executemany(INSERT_USER, [(x,) for x in users])
+                conn.executemany(UPDATE_USER, [
+                    tuple(value) + (key,) for key, value in users.items()])
+        except sqlite3.Error as ex:
+            logger.error('Stats flush failed: %s', ex)
+            with self._lock:
+                for key, value in torrents.items():
+                    merge(self._torrents, key, value)
+                for key, value in users.items():
+                    merge(self._users, key, value)
+            return
+        logger.debug('Flushed stats of %i torrents and %i users',
+                     len(torrents), len(users))
+
+    def _run(self):
+        conn = None
+        while True:
+            stopping = self._stop.wait(self.flush_interval)
+            try:
+                if conn is None:
+                    conn = self.connect()
+                self.flush(conn)
+            except sqlite3.Error as ex:
+                logger.error('Stats database %s error: %s', self.path, ex)
+            if stopping:
+                break
+        if conn is not None:
+            conn.close()
+
+
+def merge(counters, key, delta):
+    """ Add delta values to counters list under key """
+    values = counters.get(key)
+    if values is None:
+        counters[key] = list(delta)
+    else:
+        for i, value in enumerate(delta):
+            values[i] += value